@@ -0,0 +1,259 @@
+"""
+Micro-benchmarks of the backend on synthetic tracker data (synthetic_data.py) at several scales: the derived
+data updates of /initialize-data, representative SQL as execute_query runs it (against the tracker DB and the
+analytics replica), result formatting and chat listing. Everything runs in a temporary APPDATA.
+
+    python benchmarks/micro_benchmarks.py --days 7,90,365 --output micro.json
+    python benchmarks/micro_benchmarks.py --baseline micro.json --tolerance 0.25
+
+With --baseline the exit code is 1 if a median time got slower than the baseline by more than the tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+from synthetic_data import generate
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+
+# Shaped like the queries write_query produces; {day} is the last day with data
+QUERIES = {
+    "activity_time_day": """
+        SELECT activity, SUM(durationInSeconds) AS seconds FROM window_activity
+        WHERE ts >= '{day}' AND ts < date('{day}', '+1 day')
+        GROUP BY activity ORDER BY seconds DESC
+    """,
+    "top_apps_week": """
+        SELECT processName, ROUND(SUM(durationInSeconds) / 3600.0, 2) AS hours FROM window_activity
+        WHERE ts >= date('{day}', '-6 days') AND ts < date('{day}', '+1 day')
+        GROUP BY processName ORDER BY hours DESC LIMIT 10
+    """,
+    "input_per_hour_day": """
+        SELECT strftime('%H', tsStart) AS hour, SUM(keysTotal) AS keys, SUM(clickTotal) AS clicks FROM user_input
+        WHERE tsStart >= '{day}' AND tsStart < date('{day}', '+1 day')
+        GROUP BY hour ORDER BY hour
+    """,
+    "session_ratings_month": """
+        SELECT startedAt, endedAt, durationInSeconds, question, response FROM session
+        WHERE startedAt >= date('{day}', '-30 days') ORDER BY startedAt
+    """,
+    "activity_per_day_all": """
+        SELECT date(ts) AS day, activity, SUM(durationInSeconds) AS seconds FROM window_activity
+        GROUP BY day, activity ORDER BY day
+    """,
+    "windows_week": """
+        SELECT ts, windowTitle, processName, activity, durationInSeconds FROM window_activity
+        WHERE ts >= date('{day}', '-6 days') ORDER BY ts
+    """,
+}
+
+# Its result is the input of the formatting benchmarks
+FORMATTED_QUERY = "windows_week"
+FORMAT_MODEL = "gpt-4o"
+
+
+def timed(fn: Callable, repeat: int, setup: Optional[Callable] = None) -> dict:
+    """Run fn repeat times (after setup, which is not timed) and summarize the wall times in ms."""
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - started) * 1000)
+    return {
+        "median_ms": round(statistics.median(times), 3),
+        "min_ms": round(min(times), 3),
+        "mean_ms": round(statistics.mean(times), 3),
+        "repeat": repeat,
+    }
+
+
+def split_result(data: list[dict], token_budget: int) -> list[list[dict]]:
+    """
+    The row-dict splitter chunk_result replaced, kept as its baseline: consecutive chunks of data whose
+    markdown stays within token_budget (estimated) tokens.
+    """
+    from helper.result_utils import FORMATS, estimate_tokens, markdown_header, row_tokens
+
+    if not data:
+        return [data]
+
+    layout = FORMATS["markdown"]
+    header_tokens = estimate_tokens(markdown_header(list(data[0].keys())))
+    chunks, start, tokens = [], 0, header_tokens
+
+    for i, row in enumerate(data):
+        cost = row_tokens(layout.separator.join(map(layout.cell, row.values())), layout.row_overhead)
+        if i > start and tokens + cost > token_budget:
+            chunks.append(data[start:i])
+            start, tokens = i, header_tokens
+        tokens += cost
+
+    chunks.append(data[start:])
+    return chunks
+
+
+def _remove(*paths: Path):
+    for path in paths:
+        for suffix in ("", "-wal", "-shm"):
+            Path(str(path) + suffix).unlink(missing_ok=True)
+
+
+def bench_dataset(days: int, repeat: int, workdir: Path) -> dict:
+    """Benchmarks on one generated dataset, which is copied to the tracker DB path of the temporary APPDATA."""
+    import settings
+    import sql_executor
+    from database import DB_PATH, ANALYTICS_DB_PATH, ROLLUPS_DB_PATH
+    from helper.db_modification import update_sessions_from_usage_data, add_window_activity_durations
+    from helper.replica import sync_replica
+    from helper.result_utils import chunk_result, format_result_as_markdown
+    from helper.rollups import refresh_rollups
+
+    pristine = workdir / f"tracker-{days}d.sqlite"
+    rows = generate(pristine, days)
+    results = {}
+
+    def fresh_tracker():
+        _remove(DB_PATH, ANALYTICS_DB_PATH, ROLLUPS_DB_PATH)
+        shutil.copyfile(pristine, DB_PATH)
+
+    # Derived data, as /initialize-data computes it: a full run on fresh data, then a run with nothing new
+    results["update_sessions_from_usage_data/full"] = timed(
+        lambda: update_sessions_from_usage_data(DB_PATH, incremental=False), repeat, fresh_tracker)
+    results["update_sessions_from_usage_data/incremental"] = timed(
+        lambda: update_sessions_from_usage_data(DB_PATH), repeat)
+    results["add_window_activity_durations/full"] = timed(
+        lambda: add_window_activity_durations(DB_PATH, incremental=False), repeat, fresh_tracker)
+    update_sessions_from_usage_data(DB_PATH, incremental=False)
+    results["add_window_activity_durations/incremental"] = timed(
+        lambda: add_window_activity_durations(DB_PATH), repeat)
+
+    with sqlite3.connect(DB_PATH) as conn:
+        day = conn.execute("SELECT date(MAX(ts)) FROM window_activity").fetchone()[0]
+
+    def run_query(name: str):
+        execution = sql_executor.QueryExecution(QUERIES[name].format(day=day), settings.SQL_TIMEOUT_SECONDS,
+                                                settings.SQL_MAX_ROWS, settings.SQL_MAX_BYTES)
+        return execution.run()
+
+    def bench_queries(target: str):
+        for name in QUERIES:
+            stats = timed(lambda: run_query(name), repeat)
+            stats["rows"] = len(run_query(name).result)
+            results[f"sql/{name}/{target}"] = stats
+
+    # Queries go to the tracker DB until the replica exists (database.query_db_path)
+    bench_queries("tracker")
+    results["sync_replica/full"] = timed(lambda: sync_replica(DB_PATH, incremental=False), repeat,
+                                         lambda: _remove(ANALYTICS_DB_PATH))
+    results["refresh_rollups/full"] = timed(lambda: refresh_rollups(DB_PATH, incremental=False), repeat,
+                                            lambda: _remove(ROLLUPS_DB_PATH))
+    bench_queries("replica")
+
+    result = run_query(FORMATTED_QUERY).result
+    token_budget = settings.chunk_token_budget(FORMAT_MODEL)
+    dicts = result.to_dicts()
+    results["format_result_as_markdown"] = timed(lambda: format_result_as_markdown(result), repeat)
+    results["split_result"] = timed(lambda: split_result(dicts, token_budget), repeat)
+    results["chunk_result"] = timed(
+        lambda: chunk_result(result, token_budget, settings.result_format(FORMAT_MODEL)), repeat)
+    for name in ("format_result_as_markdown", "split_result", "chunk_result"):
+        results[name]["rows"] = len(result)
+
+    return {"rows": rows, "tracker_bytes": pristine.stat().st_size, "results": results}
+
+
+def bench_checkpoints(chats: int, repeat: int, workdir: Path, page_size: int = 50) -> dict:
+    """list_chats on a checkpoint DB with the given number of chats."""
+    from checkpoint_db import CheckpointDB
+
+    db = CheckpointDB(workdir / "chat_checkpoints.db")
+    with db.write() as cursor:
+        cursor.executemany(
+            "INSERT INTO chat_metadata (thread_id, title, last_activity, status) VALUES (?, ?, ?, 'active')",
+            [(str(i), f"Chat {i}", f"2025-01-01T00:00:{i % 60:02d}.{i:06d}") for i in range(1, chats + 1)],
+        )
+
+    def all_pages():
+        cursor = None
+        while True:
+            _, cursor = db.list_chats(page_size, cursor)
+            if cursor is None:
+                break
+
+    results = {
+        "list_chats/first_page": timed(lambda: db.list_chats(page_size), repeat),
+        "list_chats/all_pages": timed(all_pages, repeat),
+        "list_chats/unpaged": timed(lambda: db.list_chats(), repeat),
+    }
+    db.close()
+    return {"chats": chats, "results": results}
+
+
+def _medians(report: dict) -> dict[str, float]:
+    medians = {f"checkpoints/{name}": stats["median_ms"] for name, stats in report["checkpoints"]["results"].items()}
+    for days, dataset in report["datasets"].items():
+        medians.update({f"{days}d/{name}": stats["median_ms"] for name, stats in dataset["results"].items()})
+    return medians
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Benchmarks whose median is more than tolerance (fraction) slower than in the baseline report."""
+    old_medians = _medians(baseline)
+    regressions = []
+    for name, new in _medians(report).items():
+        old = old_medians.get(name)
+        if old and new > old * (1 + tolerance):
+            regressions.append(f"{name}: {old} -> {new} ms (+{(new / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", default="7,90", help="comma-separated dataset sizes in days")
+    parser.add_argument("--chats", type=int, default=1000, help="chats in the checkpoint DB for list_chats")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", type=Path, help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", type=Path, help="JSON report of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="pq-bench-") as tmp:
+        workdir = Path(tmp)
+        # The backend modules derive their paths from APPDATA when imported
+        os.environ["APPDATA"] = str(workdir)
+        sys.path.insert(0, str(SRC_DIR))
+
+        report = {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "datasets": {days: bench_dataset(int(days), args.repeat, workdir) for days in args.days.split(",")},
+            "checkpoints": bench_checkpoints(args.chats, args.repeat, workdir),
+        }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text, encoding="utf-8")
+    else:
+        print(text)
+
+    if args.baseline:
+        regressions = compare(report, json.loads(args.baseline.read_text(encoding="utf-8")), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
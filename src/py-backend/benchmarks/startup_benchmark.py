@@ -0,0 +1,158 @@
+"""
+Cold-start benchmark of the backend: import time per module (python -X importtime) and, over several fresh
+server processes, the time until the port answers /health and until /health reports the engine as ready.
+
+    python benchmarks/startup_benchmark.py --runs 5 --output startup.json
+    python benchmarks/startup_benchmark.py --baseline startup.json --tolerance 0.25
+
+With --baseline the exit code is 1 if a median time got slower than the baseline by more than the tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+
+# Each imported in its own fresh interpreter: what the server needs to bind, and what it loads in the background
+IMPORTED_MODULES = ["server_rest", "chat_engine"]
+
+# Modules reported individually besides the slowest ones
+TRACKED_MODULES = [
+    "server_rest", "chat_engine", "database", "checkpoint_db", "prompt_registry",
+    "fastapi", "uvicorn", "langgraph", "langchain_core", "langchain_openai", "langchain_community", "sqlalchemy",
+]
+
+SERVER_SCRIPT = """
+import sys, uvicorn
+uvicorn.run("server_rest:app", host="127.0.0.1", port=int(sys.argv[1]), log_level="warning")
+"""
+
+
+def measure_imports(module: str, top: int = 15) -> dict:
+    """Cumulative import time in ms of the tracked and the slowest top-level modules, in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SRC_DIR, capture_output=True, text=True, check=True,
+    )
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace("import time:", "|", 1).split("|")]
+        if not cumulative_us.isdigit():
+            continue  # header line
+        cumulative[name] = int(cumulative_us) / 1000
+
+    top_level = {name: ms for name, ms in cumulative.items() if "." not in name}
+    slowest = dict(sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:top])
+    tracked = {name: cumulative[name] for name in TRACKED_MODULES if name in cumulative}
+    return {"total_ms": cumulative.get(module), "tracked_ms": tracked, "slowest_ms": slowest}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _health(port: int):
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+            return json.loads(response.read())
+    except (urllib.error.URLError, ConnectionError, socket.timeout):
+        return None
+
+
+def measure_startup(timeout: float, fast_startup: bool) -> dict:
+    """Start one server process and time first /health answer (bound) and status "ready", in seconds."""
+    port = _free_port()
+    env = {**os.environ, "PQ_FAST_STARTUP": "1" if fast_startup else "0"}
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-c", SERVER_SCRIPT, str(port)],
+        cwd=SRC_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+    )
+    bound = ready = None
+    status = None
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"Server exited with {process.returncode}: {process.stderr.read()[-2000:]}")
+            health = _health(port)
+            if health is not None:
+                bound = bound or time.perf_counter() - started
+                status = health["status"]
+                if status != "starting":
+                    ready = time.perf_counter() - started
+                    break
+            time.sleep(0.01)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return {"time_to_bind_s": bound, "time_to_ready_s": ready, "status": status}
+
+
+def _median(runs: list[dict], key: str):
+    values = [run[key] for run in runs if run[key] is not None]
+    return round(statistics.median(values), 4) if values else None
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Medians that are more than tolerance (fraction) slower than in the baseline report."""
+    regressions = []
+    checks = {f"median.{key}": (value, baseline.get("median", {}).get(key)) for key, value in report["median"].items()}
+    for module, imports in report["imports"].items():
+        checks[f"imports.{module}"] = (imports["total_ms"], baseline.get("imports", {}).get(module, {}).get("total_ms"))
+    for name, (new, old) in checks.items():
+        if new is not None and old and new > old * (1 + tolerance):
+            regressions.append(f"{name}: {old} -> {new} (+{(new / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for one server to be ready")
+    parser.add_argument("--no-fast-startup", action="store_true", help="benchmark with PQ_FAST_STARTUP=0")
+    parser.add_argument("--output", type=Path, help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", type=Path, help="JSON report of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    runs = [measure_startup(args.timeout, not args.no_fast_startup) for _ in range(args.runs)]
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "fast_startup": not args.no_fast_startup,
+        "imports": {module: measure_imports(module) for module in IMPORTED_MODULES},
+        "runs": runs,
+        "median": {key: _median(runs, key) for key in ("time_to_bind_s", "time_to_ready_s")},
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text, encoding="utf-8")
+    else:
+        print(text)
+
+    if args.baseline:
+        regressions = compare(report, json.loads(args.baseline.read_text(encoding="utf-8")), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Synthetic PersonalAnalytics tracker database: window_activity, user_input, usage_data and
+experience_sampling_responses for any number of days, shaped like real tracker data (work days with a
+lunch break, short app switches with the occasional long meeting, hourly self-reports, per-minute input).
+The same seed and arguments always give the same database.
+
+    python benchmarks/synthetic_data.py --days 365 --output /tmp/database.sqlite
+"""
+import argparse
+import random
+import sqlite3
+import uuid
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Iterator, NamedTuple
+
+DEFAULT_START = date(2025, 1, 6)  # a Monday
+
+SCHEMA = """
+    CREATE TABLE window_activity (
+        id TEXT PRIMARY KEY,
+        windowTitle TEXT,
+        processName TEXT,
+        processPath TEXT,
+        processId INTEGER,
+        url TEXT,
+        activity TEXT,
+        ts TEXT,
+        createdAt TEXT,
+        updatedAt TEXT,
+        deletedAt TEXT
+    );
+    CREATE TABLE user_input (
+        id TEXT PRIMARY KEY,
+        keysTotal INTEGER,
+        clickTotal INTEGER,
+        movedDistance INTEGER,
+        scrollDelta INTEGER,
+        tsStart TEXT,
+        tsEnd TEXT,
+        createdAt TEXT,
+        updatedAt TEXT,
+        deletedAt TEXT
+    );
+    CREATE TABLE usage_data (
+        id TEXT PRIMARY KEY,
+        type TEXT,
+        description TEXT,
+        created_at TEXT
+    );
+    CREATE TABLE experience_sampling_responses (
+        id TEXT PRIMARY KEY,
+        question TEXT,
+        responseOptions TEXT,
+        scale INTEGER,
+        response TEXT,
+        promptedAt TEXT,
+        skipped BOOLEAN,
+        createdAt TEXT,
+        updatedAt TEXT,
+        deletedAt TEXT
+    );
+"""
+
+
+class App(NamedTuple):
+    process: str
+    path: str
+    activity: str
+    titles: list[str]
+    weight: float
+    mean_seconds: float  # mean time in the window before the next switch
+    browser: bool = False
+
+
+APPS = [
+    App("Code", r"C:\Program Files\Microsoft VS Code\Code.exe", "DevCode",
+        ["{file}.py - {project} - Visual Studio Code", "{file}.ts - {project} - Visual Studio Code"], 22, 60),
+    App("Code", r"C:\Program Files\Microsoft VS Code\Code.exe", "DevDebug",
+        ["{file}.py - {project} - Visual Studio Code [Debugging]"], 5, 60),
+    App("WindowsTerminal", r"C:\Program Files\WindowsApps\WindowsTerminal.exe", "DevVc",
+        ["git - {project}", "PowerShell"], 5, 25),
+    App("OUTLOOK", r"C:\Program Files\Microsoft Office\root\Office16\OUTLOOK.EXE", "Email",
+        ["Inbox - {person}@uzh.ch - Outlook", "RE: {topic} - Message (HTML)"], 12, 35),
+    App("ms-teams", r"C:\Program Files\WindowsApps\MSTeams\ms-teams.exe", "InstantMessaging",
+        ["Chat | {person} | Microsoft Teams"], 10, 20),
+    App("ms-teams", r"C:\Program Files\WindowsApps\MSTeams\ms-teams.exe", "PlannedMeeting",
+        ["{topic} sync | Microsoft Teams"], 0.5, 2400),
+    App("WINWORD", r"C:\Program Files\Microsoft Office\root\Office16\WINWORD.EXE", "ReadWriteDocument",
+        ["{topic} report.docx - Word"], 7, 90),
+    App("chrome", r"C:\Program Files\Google\Chrome\Application\chrome.exe", "WebBrowsingWorkRelated",
+        ["{topic} - Stack Overflow - Google Chrome", "{project} - GitHub - Google Chrome"], 14, 40, True),
+    App("chrome", r"C:\Program Files\Google\Chrome\Application\chrome.exe", "WebBrowsingOther",
+        ["YouTube - Google Chrome", "News - Google Chrome"], 5, 50, True),
+    App("explorer", r"C:\Windows\explorer.exe", "FileNavigationInExplorer", ["{project}", "Downloads"], 4, 10),
+    App("Notion", r"C:\Users\user\AppData\Local\Programs\Notion\Notion.exe", "Planning",
+        ["{topic} planning - Notion"], 4, 90),
+    App("Spotify", r"C:\Users\user\AppData\Roaming\Spotify\Spotify.exe", "Other", ["Spotify Premium"], 2, 10),
+]
+
+URLS = {
+    "WebBrowsingWorkRelated": ["https://stackoverflow.com/questions/{n}", "https://github.com/{project}/pull/{n}"],
+    "WebBrowsingOther": ["https://www.youtube.com/watch?v={n}", "https://news.example.com/{n}"],
+}
+
+FILES = ["main", "server_rest", "chat_engine", "utils", "schemas", "index", "app", "settings", "models", "views"]
+PROJECTS = ["PersonalQuery", "PersonalAnalytics", "thesis", "website", "data-pipeline"]
+PEOPLE = ["anna", "ben", "chen", "dana", "eli"]
+TOPICS = ["Sprint", "Budget", "Release", "Study design", "Onboarding", "Roadmap"]
+
+QUESTIONS = [
+    "Compared to your normal level of productivity, how productive do you consider the previous session?",
+    "How well did you spend your time in the previous session?",
+]
+
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class Tables(NamedTuple):
+    window_activity: list[tuple]
+    user_input: list[tuple]
+    usage_data: list[tuple]
+    experience_sampling_responses: list[tuple]
+
+
+def _ts(moment: datetime, millis: bool = True) -> str:
+    return moment.strftime(TS_FORMAT) + (f".{moment.microsecond // 1000:03d}" if millis else "")
+
+
+def _uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def _title(rng: random.Random, template: str) -> str:
+    return template.format(file=rng.choice(FILES), project=rng.choice(PROJECTS),
+                           person=rng.choice(PEOPLE), topic=rng.choice(TOPICS))
+
+
+def _windows(rng: random.Random, start: datetime, end: datetime, tables: Tables):
+    weights = [app.weight for app in APPS]
+    moment = start
+    lunch = start.replace(hour=12, minute=rng.randint(0, 30), second=0)
+    lunch_taken = False
+    while moment < end:
+        if not lunch_taken and moment >= lunch:
+            # Idle over lunch; the tracker records the lock screen as its own window
+            lunch_taken = True
+            tables.window_activity.append(_window_row(
+                rng, moment, "LockApp", r"C:\Windows\SystemApps\LockApp.exe", "Idle", "Windows Default Lock Screen", None))
+            moment += timedelta(minutes=rng.randint(30, 60))
+            continue
+
+        app = rng.choices(APPS, weights)[0]
+        url = None
+        if app.browser:
+            url = rng.choice(URLS[app.activity]).format(project=rng.choice(PROJECTS), n=rng.randint(1, 99999))
+        tables.window_activity.append(_window_row(
+            rng, moment, app.process, app.path, app.activity, _title(rng, rng.choice(app.titles)), url))
+        moment += timedelta(seconds=max(1.0, rng.expovariate(1 / app.mean_seconds)),
+                            milliseconds=rng.randint(0, 999))
+
+
+def _window_row(rng: random.Random, moment: datetime, process: str, path: str, activity: str, title: str, url):
+    ts = _ts(moment)
+    return _uuid(rng), title, process, path, rng.randint(1000, 30000), url, activity, ts, ts, ts, None
+
+
+def _input(rng: random.Random, start: datetime, end: datetime, tables: Tables):
+    """One aggregate per minute of activity, as the tracker's input aggregation writes them."""
+    moment = start
+    while moment < end:
+        following = moment + timedelta(minutes=1)
+        typing = rng.random() < 0.6
+        keys = int(rng.gammavariate(2, 40)) if typing else 0
+        clicks = int(rng.gammavariate(1.5, 4))
+        tables.user_input.append((
+            _uuid(rng), keys, clicks, int(rng.gammavariate(2, 800)), int(rng.gammavariate(1, 300)) * rng.choice([0, 1]),
+            _ts(moment), _ts(following), _ts(following), _ts(following), None,
+        ))
+        moment = following
+
+
+def _usage(rng: random.Random, start: datetime, end: datetime, tables: Tables):
+    def event(moment: datetime, event_type: str, description: str = ""):
+        tables.usage_data.append((_uuid(rng), event_type, description, _ts(moment, millis=False)))
+
+    event(start - timedelta(minutes=2), "APP_START", "App started")
+    moment = start + timedelta(minutes=rng.randint(50, 90))
+    while moment < end:
+        event(moment, "EXPERIENCE_SAMPLING_AUTOMATICALLY_OPENED")
+        skipped = rng.random() < 0.2
+        prompted = _ts(moment.replace(microsecond=rng.randint(0, 999) * 1000))
+        tables.experience_sampling_responses.append((
+            _uuid(rng), rng.choice(QUESTIONS), '["Not at all", "Very"]', 7,
+            None if skipped else str(rng.randint(1, 7)), prompted, int(skipped), prompted, prompted, None,
+        ))
+        if rng.random() < 0.05:
+            event(moment + timedelta(minutes=5), "EXPERIENCE_SAMPLING_MANUALLY_OPENED")
+        moment += timedelta(minutes=rng.randint(50, 90))
+    event(end, "APP_QUIT", "App quit")
+
+
+def generate_day(rng: random.Random, day: date) -> Tables:
+    """Rows of one day; most weekends stay empty."""
+    tables = Tables([], [], [], [])
+    if day.weekday() >= 5 and rng.random() < 0.85:
+        return tables
+    start = datetime.combine(day, datetime.min.time()) + timedelta(hours=max(6.0, rng.gauss(8.5, 0.5)))
+    end = start + timedelta(hours=min(11.0, max(2.0, rng.gauss(8.5, 0.7))))
+    _windows(rng, start, end, tables)
+    _input(rng, start, end, tables)
+    _usage(rng, start, end, tables)
+    return tables
+
+
+def iter_days(days: int, start: date = DEFAULT_START, seed: int = 0) -> Iterator[Tables]:
+    rng = random.Random(seed)
+    for offset in range(days):
+        yield generate_day(rng, start + timedelta(days=offset))
+
+
+def generate(path: Path, days: int, start: date = DEFAULT_START, seed: int = 0) -> dict[str, int]:
+    """Write a tracker database with days of data to path (replacing it). Returns the row count per table."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.unlink(missing_ok=True)
+
+    conn = sqlite3.connect(str(path))
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.executescript(SCHEMA)
+    counts = dict.fromkeys(Tables._fields, 0)
+    for tables in iter_days(days, start, seed):
+        for table, rows in zip(Tables._fields, tables):
+            if rows:
+                conn.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * len(rows[0]))})", rows)
+                counts[table] += len(rows)
+    conn.commit()
+    conn.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--start", type=date.fromisoformat, default=DEFAULT_START)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, required=True)
+    args = parser.parse_args()
+
+    for table, count in generate(args.output, args.days, args.start, args.seed).items():
+        print(f"{table}: {count} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+# PyInstaller spec of dist/pq-backend.exe, the backend electron-builder.config.cjs ships with the app.
+# Export the prompt bundle first, so the backend starts without the LangChain hub:
+#   cd src && python prompt_registry.py && cd .. && pyinstaller pq-backend.spec
+import os
+
+PROMPT_BUNDLE = os.path.join('src', 'prompts', 'bundle')
+
+if not os.path.exists(os.path.join(PROMPT_BUNDLE, 'manifest.json')):
+    raise SystemExit(f"No prompt bundle in {PROMPT_BUNDLE}, export it with 'python prompt_registry.py' in src")
+
+a = Analysis(
+    [os.path.join('src', 'main.py')],
+    pathex=['src'],
+    # prompt_registry.PROMPT_BUNDLE_DIR
+    datas=[(PROMPT_BUNDLE, os.path.join('prompts', 'bundle'))],
+    # Imported with importlib by server_rest.start_engine, so the analysis doesn't see it
+    hiddenimports=['chat_engine'],
+)
+pyz = PYZ(a.pure)
+
+exe = EXE(
+    pyz,
+    a.scripts,
+    a.binaries,
+    a.datas,
+    [],
+    name='pq-backend',
+    console=True,
+    version=os.path.join('build', 'file_version.txt'),
+)
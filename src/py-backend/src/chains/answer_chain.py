@@ -1,66 +1,158 @@
-from langchain import hub
+import asyncio
+import logging
+
 from langchain_core.messages import AIMessage, AIMessageChunk, SystemMessage
 from langchain_core.prompt_values import ChatPromptValue
 
+import settings
 from helper.env_loader import load_env
 from llm_registry import LLMRegistry
+from prompt_registry import PromptRegistry
 from schemas import State
 from langchain_openai import ChatOpenAI
 
 load_env()
-prompt_template_partial = hub.pull("partial_answer")
-prompt_template_summarize = hub.pull("summarize_answers")
 
-prompt_template = hub.pull("generate_answer")
-prompt_template_general = hub.pull("general_answer")
+# Tags the LLM calls that produce the user-facing answer, their tokens are forwarded to the client
+ANSWER_STREAM_TAG = "answer_stream"
+ANSWER_STREAM_CONFIG = {"tags": [ANSWER_STREAM_TAG]}
+
+# Appended to the result when sql_executor stopped at its row/byte budget or timeout
+TRUNCATION_NOTE = (
+    "Note: this SQL result is incomplete, it was cut off at the row/size/time limit of the query engine. "
+    "Make clear in the answer that it is based on partial data."
+)
+
+# Appended when preflight_query had the result aggregated locally instead of passing every row
+AGGREGATION_NOTE = (
+    "Note: the query returned too many rows to pass on, this is a summary of them ({}). "
+    "Answer from the totals and averages, not individual rows."
+)
+
 
+def result_notes(state: State) -> list[str]:
+    notes = []
+    aggregation = (state.get("preflight") or {}).get("aggregation")
+    if aggregation:
+        notes.append(AGGREGATION_NOTE.format(aggregation))
+    if state.get("truncated"):
+        notes.append(TRUNCATION_NOTE)
+    return notes
 
-def answer_chain(llm: ChatOpenAI, state: State):
+
+def result_for_prompt(state: State) -> list[str]:
+    return state["result"] + result_notes(state)
+
+
+async def answer_chain(llm: ChatOpenAI, state: State):
     """Answer question using retrieved information as context."""
     prompt = (
         "Given the following user question, corresponding SQL query, "
         "and SQL result, answer the user question.\n\n"
         f'Question: {state["question"]}\n'
         f'SQL Query: {state["query"]}\n'
-        f'SQL Result: {state["result"]}'
+        f'SQL Result: {result_for_prompt(state)}'
     )
-    response = llm.invoke(prompt)
+    response = await llm.ainvoke(prompt)
     return response.content
 
 
-def generate_answer(state: State) -> State:
+async def invoke_with_retries(llm: ChatOpenAI, prompts: list) -> list[str | None]:
+    """
+    Invoke llm on all prompts concurrently, preserving order.
+    Failed prompts are retried individually; prompts that keep failing yield None.
+    """
+    config = {"max_concurrency": settings.CHUNK_SUMMARY_CONCURRENCY}
+    responses = await llm.abatch(prompts, config=config, return_exceptions=True)
+    results = [None if isinstance(r, Exception) else r.content for r in responses]
+
+    semaphore = asyncio.Semaphore(settings.CHUNK_SUMMARY_CONCURRENCY)
+
+    async def retry(i: int):
+        for attempt in range(settings.CHUNK_SUMMARY_RETRIES):
+            await asyncio.sleep(0.5 * 2 ** attempt)
+            try:
+                async with semaphore:
+                    results[i] = (await llm.ainvoke(prompts[i])).content
+                return
+            except Exception as e:
+                logging.warning(f"[generate_answer] Chunk {i + 1} failed (attempt {attempt + 1}): {e}")
+
+    await asyncio.gather(*(retry(i) for i, r in enumerate(results) if r is None))
+    return results
+
+
+def join_summaries(summaries: list[str | None], labels: list[str]) -> str:
+    return "\n\n".join(
+        f"{label}:\n{summary if summary is not None else '(this part of the result could not be summarized)'}"
+        for label, summary in zip(labels, summaries)
+    )
+
+
+def part_label(part: int, first_chunk: int, last_chunk: int) -> str:
+    chunks = f"chunk {first_chunk}" if first_chunk == last_chunk else f"chunks {first_chunk}–{last_chunk}"
+    return f"Part {part} ({chunks})"
+
+
+async def summarize_chunks(llm: ChatOpenAI, question: str, chunks: list[str]) -> tuple[list[str | None], str]:
+    """
+    Map: summarize every chunk. Reduce: combine the summaries, tree-wise if there are too many. A group that
+    can't be combined passes its summaries on to the next level as they are.
+    """
+    summaries = await invoke_with_retries(llm, [
+        PromptRegistry.get("partial_answer").invoke({"question": question, "result": chunk_markdown})
+        for chunk_markdown in chunks
+    ])
+    if all(summary is None for summary in summaries):
+        raise RuntimeError("None of the result chunks could be summarized.")
+
+    level = summaries
+    labels = [f"Chunk {i + 1}" for i in range(len(summaries))]
+    # First and last chunk (1-based) every entry of the level covers
+    spans = [(i + 1, i + 1) for i in range(len(summaries))]
+    fan_in = max(settings.SUMMARY_FAN_IN, 2)
+    while settings.SUMMARY_TREE_REDUCE and len(level) > fan_in:
+        starts = range(0, len(level), fan_in)
+        groups = [join_summaries(level[i:i + fan_in], labels[i:i + fan_in]) for i in starts]
+        combined = await invoke_with_retries(llm, [
+            PromptRegistry.get("summarize_answers").invoke({"question": question, "summaries": group})
+            for group in groups
+        ])
+        if all(summary is None for summary in combined):
+            raise RuntimeError("None of the chunk summaries could be combined.")
+
+        level = [summary if summary is not None else group for summary, group in zip(combined, groups)]
+        spans = [(spans[i][0], spans[min(i + fan_in, len(spans)) - 1][1]) for i in starts]
+        labels = [part_label(part, first, last) for part, (first, last) in enumerate(spans, start=1)]
+
+    return summaries, join_summaries(level, labels)
+
+
+async def generate_answer(state: State) -> State:
     """For LangGraph Orchestration"""
     llm = LLMRegistry.get("openai")
     messages = state["messages"]
 
     if len(state["result"]) == 1:
-        prompt: ChatPromptValue = prompt_template.invoke({
+        prompt: ChatPromptValue = PromptRegistry.get("generate_answer").invoke({
             "question": state["question"],
-            "result": state["result"],
+            "result": result_for_prompt(state),
             "current_time": state["current_time"]
         })
-        response = llm.invoke(prompt.to_string()).content
+        response = (await llm.ainvoke(prompt.to_string(), config=ANSWER_STREAM_CONFIG)).content
     else:
-        summaries = []
-
-        for i, chunk_markdown in enumerate(state["result"]):
-            prompt: ChatPromptValue = prompt_template_partial.invoke({
-                "question": state["question"],
-                "result": chunk_markdown
-            })
-            response = llm.invoke(prompt).content
-            summaries.append(response)
-            messages.append(AIMessageChunk(content=response))
-
-        joined_summaries = "\n\n".join(
-            f"Chunk {i + 1}:\n{summary}" for i, summary in enumerate(summaries)
-        )
-
-        prompt: ChatPromptValue = prompt_template_summarize.invoke({
+        summaries, joined_summaries = await summarize_chunks(llm, state["question"], state["result"])
+        for summary in summaries:
+            if summary is not None:
+                messages.append(AIMessageChunk(content=summary))
+
+        for note in result_notes(state):
+            joined_summaries += f"\n\n{note}"
+        prompt: ChatPromptValue = PromptRegistry.get("summarize_answers").invoke({
             "question": state["question"],
             "summaries": joined_summaries,
         })
-        response = llm.invoke(prompt).content
+        response = (await llm.ainvoke(prompt, config=ANSWER_STREAM_CONFIG)).content
 
     state["answer"] = response
 
@@ -71,15 +163,17 @@ def generate_answer(state: State) -> State:
                 "tables": state["tables"],
                 "activities": state["activities"],
                 "query": state["query"],
-                "result": state["raw_result"]
+                "result": state["raw_result"],
+                "truncated": state.get("truncated", False),
+                "preflight": state.get("preflight") or {}
             }
         }
     ))
     return state
 
 
-def general_answer(state: State) -> State:
-    prompt = prompt_template_general.invoke(state['current_time'])
+async def general_answer(state: State) -> State:
+    prompt = PromptRegistry.get("general_answer").invoke(state['current_time'])
     system_prompt = prompt.messages[0].content
 
     llm = LLMRegistry.get("openai-high-temp")
@@ -91,7 +185,7 @@ def general_answer(state: State) -> State:
     else:
         temp_messages.insert(0, SystemMessage(content=system_prompt))
 
-    response = llm.invoke(messages).content
+    response = (await llm.ainvoke(messages, config=ANSWER_STREAM_CONFIG)).content
     state["answer"] = response
     messages.append(AIMessage(content=response))
     return state
@@ -1,16 +1,15 @@
-from langchain import hub
 from langchain_core.messages import SystemMessage
 
 from helper.env_loader import load_env
 from llm_registry import LLMRegistry
+from prompt_registry import PromptRegistry
 from schemas import State, Question
 
 load_env()
-prompt_template = hub.pull("give_context")
 
 
-def give_context(state: State) -> State:
-    prompt = prompt_template.invoke(state['current_time'])
+async def give_context(state: State) -> State:
+    prompt = PromptRegistry.get("give_context").invoke(state['current_time'])
     system_prompt = prompt.messages[0].content
 
     llm = LLMRegistry.get("openai")
@@ -22,7 +21,7 @@ def give_context(state: State) -> State:
     else:
         temp_messages.insert(0, SystemMessage(content=system_prompt))
 
-    enriched_question = llm.with_structured_output(Question).invoke(temp_messages)
+    enriched_question = await llm.with_structured_output(Question).ainvoke(temp_messages)
     state['question'] = enriched_question
 
     return state
@@ -1,30 +1,24 @@
+import asyncio
 import logging
-import os
-import sqlite3
-from pathlib import Path
 
-from langchain import hub
 from langchain_core.messages import SystemMessage
 from langchain_core.output_parsers.openai_tools import PydanticToolsParser
 from langchain_core.prompt_values import ChatPromptValue
 from langchain_openai import ChatOpenAI
 
+from checkpoint_db import get_checkpoint_db
 from helper.env_loader import load_env
 from llm_registry import LLMRegistry
+from prompt_registry import PromptRegistry
 from schemas import QuestionType, State
 
 load_env()
 output_parser = PydanticToolsParser(tools=[QuestionType])
-prompt_template = hub.pull("classify_question")
-prompt_template_title = hub.pull("generate_title")
-
-APPDATA_PATH = Path(os.getenv("APPDATA", Path.home()))
-CHECKPOINT_DB_PATH = APPDATA_PATH / "personal-query" / "chat_checkpoints.db"
 
 
 def classify_chain(llm: ChatOpenAI):
     return (
-            prompt_template
+            PromptRegistry.get("classify_question")
             | llm.with_structured_output(QuestionType)
             | (lambda parsed: parsed["questionType"])
     )
@@ -38,9 +32,9 @@ def classify_question_old(state: State) -> State:
     return state
 
 
-def classify_question(state: State) -> State:
+async def classify_question(state: State) -> State:
     llm = LLMRegistry.get("openai")
-    prompt = prompt_template.invoke(state['question'])
+    prompt = PromptRegistry.get("classify_question").invoke(state['question'])
     system_prompt = prompt.messages[0].content
 
     temp_messages = state['messages'].copy()
@@ -49,7 +43,7 @@ def classify_question(state: State) -> State:
     else:
         temp_messages.insert(0, SystemMessage(content=system_prompt))
 
-    parsed = llm.with_structured_output(QuestionType).invoke(temp_messages)
+    parsed = await llm.with_structured_output(QuestionType).ainvoke(temp_messages)
     state['branch'] = parsed["questionType"]
     return state
 
@@ -60,28 +54,20 @@ def strip_outer_quotes(text: str) -> str:
     return text.strip()
 
 
-def generate_title(state: State) -> State:
+async def generate_title(state: State) -> State:
     """For LangGraph Orchestration"""
     llm = LLMRegistry.get("openai-high-temp")
-    prompt: ChatPromptValue = prompt_template_title.invoke({
+    prompt: ChatPromptValue = PromptRegistry.get("generate_title").invoke({
         "question": state["question"],
         "max_characters": 15
     })
 
-    raw_title = llm.invoke(prompt.to_string()).content
+    raw_title = (await llm.ainvoke(prompt.to_string())).content
     title = strip_outer_quotes(raw_title)
     thread_id = state["thread_id"]
 
     try:
-        conn = sqlite3.connect(str(CHECKPOINT_DB_PATH), check_same_thread=False)
-        cursor = conn.cursor()
-        cursor.execute("""
-                UPDATE chat_metadata
-                SET title = ?
-                WHERE thread_id = ?
-            """, (title.strip(), thread_id))
-        conn.commit()
-        conn.close()
+        await asyncio.to_thread(get_checkpoint_db().set_title, thread_id, title)
     except Exception as e:
         logging.error(f"[generate_title] Failed to persist title for thread {thread_id}: {e}")
 
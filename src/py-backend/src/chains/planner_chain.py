@@ -0,0 +1,98 @@
+import asyncio
+import logging
+
+from langchain_core.messages import SystemMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+import settings
+from database import get_db, get_data_version
+from llm_registry import LLMRegistry
+from prompt_registry import PromptRegistry
+from schemas import Plan, State
+
+KNOWN_TABLES = {"session", "user_input", "window_activity"}
+BRANCHES = {"data_query", "general"}
+
+PromptRegistry.register("plan_question", ChatPromptTemplate.from_messages([
+    ("system",
+     "You plan how PersonalQuery answers the user's latest message about their PersonalAnalytics data.\n"
+     "Current time: {current_time}\n\n"
+     "Decide in one step:\n"
+     "1. questionType: \"data_query\" if answering needs the user's tracked computer interaction data, "
+     "otherwise \"general\".\n"
+     "2. question: the latest message as a standalone question. Resolve references to earlier messages and "
+     "relative time expressions (\"today\", \"last week\", \"this morning\") to absolute dates and times.\n"
+     "3. tables: the tables needed, chosen from:\n"
+     "   - session: work sessions between experience sampling prompts, with self-reported productivity\n"
+     "   - user_input: keystrokes, clicks, mouse movement and scrolling per interval\n"
+     "   - window_activity: the active window, process and activity category over time\n"
+     "4. activities: activity labels to filter window_activity on, only from this list: {activities}. "
+     "Leave it empty if no filter is needed or window_activity is not used.\n\n"
+     "For general questions return empty tables and activities."),
+    MessagesPlaceholder("messages"),
+]))
+
+# (data version, labels) of the last lookup
+_activity_labels: tuple[tuple, list[str]] | None = None
+
+
+def get_activity_labels() -> list[str]:
+    """Distinct window_activity labels, read again whenever the queried data changes (e.g. after an import)."""
+    global _activity_labels
+    version = get_data_version()
+    if _activity_labels is None or _activity_labels[0] != version:
+        rows = get_db()._execute(
+            "SELECT DISTINCT activity FROM window_activity WHERE activity IS NOT NULL ORDER BY activity"
+        )
+        _activity_labels = version, [row["activity"] for row in rows]
+    return _activity_labels[1]
+
+
+def validate_plan(plan: Plan, activity_labels: list[str]) -> bool:
+    if plan.questionType not in BRANCHES or not plan.question.strip():
+        return False
+    if plan.questionType == "general":
+        return True
+    if not plan.tables or not set(plan.tables) <= KNOWN_TABLES:
+        return False
+    if plan.activities and "window_activity" not in plan.tables:
+        return False
+    return not activity_labels or set(plan.activities) <= set(activity_labels)
+
+
+async def plan_question(state: State) -> State:
+    """
+    Planner mode: one structured-output call replacing classify_question, give_context, get_tables and
+    extract_activities. Sets state["planned"] to False if the plan is unusable, the graph then falls back
+    to the fine-grained path.
+    """
+    llm = LLMRegistry.get("openai")
+    history = [m for m in state["messages"] if not isinstance(m, SystemMessage)]
+    history = history[-settings.PLANNER_HISTORY_MESSAGES:]
+
+    try:
+        activity_labels = await asyncio.to_thread(get_activity_labels)
+        prompt = PromptRegistry.get("plan_question").invoke({
+            "current_time": state["current_time"],
+            "activities": ", ".join(activity_labels) or "(unknown)",
+            "messages": history,
+        })
+        plan: Plan = await llm.with_structured_output(Plan).ainvoke(prompt)
+    except Exception as e:
+        logging.warning(f"[plan_question] Planner call failed, falling back: {e}")
+        state["planned"] = False
+        return state
+
+    if not validate_plan(plan, activity_labels):
+        logging.info(f"[plan_question] Rejected plan, falling back: {plan}")
+        state["planned"] = False
+        return state
+
+    state["planned"] = True
+    state["branch"] = plan.questionType
+    if plan.questionType == "data_query":
+        # Same shape as give_context's output
+        state["question"] = {"question": plan.question}
+        state["tables"] = plan.tables
+        state["activities"] = plan.activities
+    return state
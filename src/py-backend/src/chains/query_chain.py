@@ -1,72 +1,181 @@
-from langchain import hub
+import asyncio
+from functools import lru_cache
+from typing import Optional
+
 from langchain_core.runnables import RunnableLambda
 from langchain_openai import ChatOpenAI
-from database import get_db
+import metrics
+import sql_executor
+from database import get_db, get_data_version
 from helper.env_loader import load_env
-from helper.result_utils import format_result_as_markdown, split_result
+from helper import query_plan
+from helper.data_refresh import ensure_fresh
+from helper.query_cache import is_volatile, result_cache
+from helper.schema_info import get_table_info
+from helper.rollups import get_rollup_table_info, ROLLUP_TABLE_INFO
+import settings
+from helper.result_utils import ColumnarResult, format_result_as_markdown, chunk_result
 from llm_registry import LLMRegistry
+from prompt_registry import PromptRegistry
 from schemas import State, QueryOutput
 
 load_env()
-db = get_db()
 
-main_template = hub.pull("sql-query-system-prompt")
-ui_template = hub.pull("user_input")
-wa_template = hub.pull("window_activity")
-session_template = hub.pull("session")
+
+@lru_cache(maxsize=256)
+def get_table_prompt(table: str, activities: tuple[str, ...] = ()) -> str:
+    """Hand-written description of one table; the templates are fixed, so each variant is built once."""
+    if table == "session":
+        return PromptRegistry.get("session").messages[0].prompt.template
+
+    elif table == "user_input":
+        return PromptRegistry.get("user_input").messages[0].prompt.template
+
+    elif table == "window_activity":
+        template_input = {
+            "activities": (
+                f"-FILTER FOR THESE ACTIVITIES: [{', '.join(activities)}]"
+                if activities else
+                "-DO NOT FILTER ACTIVITIES"
+            )
+        }
+        prompt_value = PromptRegistry.get("window_activity").invoke(template_input)
+        return prompt_value.messages[0].content
+
+    return ""
 
 
 def get_custom_table_info(state: State) -> str:
-    prompt_parts = []
     tables = state["tables"]
-    activities = state.get("activities", None)
-
-    for table in tables:
-        if table == "session":
-            prompt_parts.append(session_template.messages[0].prompt.template)
-
-        elif table == "user_input":
-            prompt_parts.append(ui_template.messages[0].prompt.template)
-
-        elif table == "window_activity":
-            template_input = {
-                "activities": (
-                    f"-FILTER FOR THESE ACTIVITIES: [{', '.join(activities)}]"
-                    if activities else
-                    "-DO NOT FILTER ACTIVITIES"
-                )
-            }
-            prompt_value = wa_template.invoke(template_input)
-            prompt_parts.append(prompt_value.messages[0].content)
+    activities = tuple(state.get("activities", None) or ())
+
+    prompt_parts = [part for part in (get_table_prompt(table, activities) for table in tables) if part]
+
+    rollup_info = get_rollup_table_info(tables)
+    if rollup_info:
+        prompt_parts.append(rollup_info)
 
     return "\n\n---\n\n".join(prompt_parts)
 
 
+def question_text(question) -> str:
+    """give_context and plan_question store the question as {"question": ...}, the initial state as a string."""
+    return question["question"] if isinstance(question, dict) else question
+
+
+def get_full_table_info(question: str) -> str:
+    """Table info when no tables were selected: every table (cached, pruned to the question), plus all rollups."""
+    rollup_info = get_rollup_table_info(list(ROLLUP_TABLE_INFO))
+    return get_table_info(question) + (f"\n\n{rollup_info}" if rollup_info else "")
+
+
 def query_chain(llm: ChatOpenAI):
     return (
-            RunnableLambda(lambda state: main_template.invoke({
-                "dialect": db.dialect,
+            RunnableLambda(lambda state: PromptRegistry.get("sql-query-system-prompt").invoke({
+                "dialect": get_db().dialect,
                 "top_k": state.get('top_k', 150),
-                "table_info": get_custom_table_info(state) if state["tables"] else db.get_table_info(),
-                "input": state["question"]
+                "table_info": (
+                    get_custom_table_info(state) if state["tables"]
+                    else get_full_table_info(question_text(state["question"]))
+                ),
+                "input": f'{question_text(state["question"])}\n\n{state["query_feedback"]}' if state.get("query_feedback")
+                else state["question"]
             }))
             | llm.with_structured_output(QueryOutput)
             | (lambda parsed: parsed["query"])
     )
 
 
-def write_query(state: State) -> State:
+async def write_query(state: State) -> State:
     """For LangGraph Orchestration"""
     llm = LLMRegistry.get("openai")
-    query = query_chain(llm).invoke(state)
+    # The rollups' table info says how far they reach, so they are brought up to date first
+    await asyncio.to_thread(ensure_fresh)
+    # the sync table-info lambda is run in the executor by RunnableLambda.ainvoke
+    query = await query_chain(llm).ainvoke(state)
     state['query'] = query
     return state
 
 
-def execute_query(state: State) -> State:
-    raw_result = db._execute(state["query"])
-    state["raw_result"] = format_result_as_markdown(raw_result)
+def check_query(sql: str, retries: int) -> dict:
+    check = query_plan.preflight(sql)
+    return {
+        "strategy": query_plan.choose_strategy(check, retries),
+        "estimated_rows": check.estimated_rows,
+        "at_least": check.at_least,
+        "full_scans": [{"table": table, "rows": rows} for table, rows in check.full_scans],
+        "plan": check.plan,
+        "summary": query_plan.summarize(check),
+        "error": check.error,
+    }
+
+
+async def preflight_query(state: State) -> State:
+    """Plan and count the generated query before it runs, and decide how its result reaches the model."""
+    await asyncio.to_thread(ensure_fresh)
+    if not settings.PREFLIGHT_ENABLED:
+        state["preflight"] = {}
+        return state
+
+    retries = state.get("preflight_retries") or 0
+    preflight = await asyncio.to_thread(check_query, state["query"], retries)
+    state["preflight"] = preflight
+    if preflight["strategy"] == query_plan.TOO_BROAD:
+        state["query_feedback"] = query_plan.too_broad_hint(state["query"], preflight["summary"])
+        state["preflight_retries"] = retries + 1
+    else:
+        state["query_feedback"] = ""
+    return state
+
+
+def format_result(result: ColumnarResult, token_budget: int, fmt: str) -> tuple[str, list[str]]:
+    """Markdown for the UI, chunks in the model's format for the answer prompts."""
+    return format_result_as_markdown(result), chunk_result(result, token_budget, fmt)
+
+
+def lookup_result(query: str, token_budget: int, fmt: str, aggregate: bool) -> tuple[Optional[tuple], object]:
+    """
+    Cache key and cached result of a query, no key if its result depends on the time it runs at (date('now')).
+    get_data_version queries SQLite, so this runs in a worker thread.
+    """
+    if is_volatile(query):
+        return None, None
+    key = result_cache.make_key(query, get_data_version(), token_budget, fmt,
+                                settings.SQL_MAX_ROWS, settings.SQL_MAX_BYTES, aggregate)
+    return key, result_cache.get(key)
+
+
+async def execute_query(state: State) -> State:
+    model_name = LLMRegistry.get("openai").model_name
+    token_budget = settings.chunk_token_budget(model_name)
+    fmt = settings.result_format(model_name)
+    preflight = state.get("preflight") or {}
+    aggregate = preflight.get("strategy") == query_plan.AGGREGATE
+    # Approval can take a while, the tracker may have written since preflight_query
+    await asyncio.to_thread(ensure_fresh)
+    key, cached = await asyncio.to_thread(lookup_result, state["query"], token_budget, fmt, aggregate)
+    metrics.observe_cache("query_result", cached is not None)
+    if cached is not None:
+        (state["raw_result"], state["result"]), state["truncated"], aggregation = cached
+        if aggregation:
+            state["preflight"] = {**preflight, "aggregation": aggregation}
+        return state
+
+    executed = await sql_executor.execute(state["query"])
+    metrics.observe_sql(len(executed.result), executed.size)
+    result, aggregation = executed.result, None
+    if aggregate:
+        aggregated = await asyncio.to_thread(query_plan.aggregate_result, result,
+                                             settings.PREFLIGHT_AGGREGATE_MAX_GROUPS)
+        if aggregated:
+            result, aggregation = aggregated
+            state["preflight"] = {**preflight, "aggregation": aggregation}
+    formatted = await asyncio.to_thread(format_result, result, token_budget, fmt)
+    state["raw_result"], state["result"] = formatted
+    state["truncated"] = executed.truncated
 
-    chunks = split_result(raw_result)
-    state["result"] = [format_result_as_markdown(chunk) for chunk in chunks]
+    # A result cut short by the timeout depends on the machine's load, so it is not reused
+    if key is not None and not executed.timed_out:
+        result_cache.put(key, (formatted, executed.truncated, aggregation),
+                         len(formatted[0]) + sum(len(chunk) for chunk in formatted[1]))
     return state
@@ -1,64 +1,95 @@
 import asyncio
+import functools
 import logging
 import os
-import sqlite3
 from datetime import datetime, UTC
 from pathlib import Path
 from typing import Dict
 
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+import aiosqlite
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, SystemMessage
 from langchain_openai import ChatOpenAI
 from langgraph.graph import START, END, StateGraph
-from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 from langgraph.graph.graph import CompiledGraph
 
 from chains.activity_chain import extract_activities
-from chains.answer_chain import generate_answer, general_answer
-from chains.query_chain import write_query, execute_query
+from chains.answer_chain import generate_answer, general_answer, ANSWER_STREAM_TAG
+from chains.query_chain import write_query, preflight_query, execute_query
 from chains.table_chain import get_tables
 from chains.init_chain import classify_question, generate_title
 from chains.context_chain import give_context
-from helper.chat_utils import title_exists, give_correct_step
+from chains.planner_chain import plan_question
+import llm_stub
+import metrics
+import settings
+from checkpoint_db import CHECKPOINT_DB_PATH, CONNECTION_PRAGMAS, get_checkpoint_db
+from helper import query_plan
+from helper.chat_utils import give_correct_step
+from helper.llm_cache import cached_step
 from helper.db_modification import update_sessions_from_usage_data, add_window_activity_durations
 from helper.env_loader import load_env
 from schemas import State
-from llm_registry import LLMRegistry
+from llm_registry import LLMRegistry, token_usage_callback
+from prompt_registry import PromptRegistry
 
 APPDATA_PATH = Path(os.getenv("APPDATA", Path.home()))
-CHECKPOINT_DB_PATH = APPDATA_PATH / "personal-query" / "chat_checkpoints.db"
 DB_PATH = APPDATA_PATH / "personal-query" / "database.sqlite"
 
 graph: CompiledGraph
-checkpointer: SqliteSaver
+checkpointer: AsyncSqliteSaver
+prompt_refresh: asyncio.Task | None = None
+checkpoint_retention: asyncio.Task | None = None
+# Chat runs in progress. The checkpoint DB's one-time full VACUUM only starts while there are none, runs that
+# start during it wait on checkpoint_vacuum instead of running into the checkpointer's busy timeout.
+active_runs = 0
+checkpoint_vacuum = asyncio.Lock()
 
 logging.basicConfig(level=logging.INFO)  # Ensure logging works even if not set up yet
 logging.info(f"👀 chat_engine.py loaded in PID: {os.getpid()}")
 
 
-def initialize():
-    global graph, checkpointer
+def memoize(node, inputs: list[str], outputs: list[str], prompts: list[str], time_sensitive: bool = False,
+            cache_if=None):
+    if not settings.LLM_CACHE_ENABLED:
+        return node
+    return cached_step(node.__name__, inputs, outputs, prompts, time_sensitive=time_sensitive,
+                       cache_if=cache_if)(node)
+
+
+async def initialize(topology: str = settings.GRAPH_TOPOLOGY):
+    """
+    Build the LLM clients and compile the graph. topology "planner" puts a single plan_question call in front
+    of the fine-grained path (classify_question, give_context, get_tables, extract_activities), which is
+    only taken when the plan fails validation. With PQ_LLM_STUB set every client talks to llm_stub instead.
+    """
+    global graph, checkpointer, prompt_refresh, checkpoint_retention
 
     load_env()
 
+    # Token usage per call for metrics, also when the answer is streamed
+    llm_metrics = {"stream_usage": True, "callbacks": [token_usage_callback]} if settings.METRICS_ENABLED else {}
+
     llm_openai = ChatOpenAI(
         model="gpt-4o",
         temperature=0.0,
-        base_url="https://api.openai.com/v1",
-        api_key=os.getenv("MY_OPENAI_API_KEY")
+        **llm_stub.connection("https://api.openai.com/v1", os.getenv("MY_OPENAI_API_KEY")),
+        **llm_metrics
     )
 
     llm_openai_high_temp = ChatOpenAI(
         model="gpt-4o",
         temperature=1.0,
-        base_url="https://api.openai.com/v1",
-        api_key=os.getenv("MY_OPENAI_API_KEY")
+        **llm_stub.connection("https://api.openai.com/v1", os.getenv("MY_OPENAI_API_KEY")),
+        **llm_metrics
     )
 
     llm_llama31 = ChatOpenAI(
         model="llama31instruct",
         temperature=0.0,
-        base_url="http://llm.hasel.dev:20769/v1",
-        api_key=os.getenv("OPENAI_API_KEY")
+        **llm_stub.connection("http://llm.hasel.dev:20769/v1", os.getenv("OPENAI_API_KEY")),
+        **llm_metrics
     )
 
     LLMRegistry.register("openai", llm_openai)
@@ -67,21 +98,58 @@ def initialize():
 
     graph_builder = StateGraph(State)
 
-    graph_builder.add_node("classify_question", classify_question)
-    graph_builder.add_node("generate_title", generate_title)
-
-    graph_builder.add_edge(START, "classify_question")
-
-    graph_builder.add_sequence([
-        give_context,
-        get_tables,
-        extract_activities,
-        write_query,
-        execute_query,
-        generate_answer
-    ])
+    graph_builder.add_node("classify_question", metrics.instrument(memoize(
+        classify_question, ["messages", "question"], ["branch"], ["classify_question"]
+    )))
+    graph_builder.add_node("generate_title", metrics.instrument(generate_title))
+
+    if topology == "planner":
+        graph_builder.add_node("plan_question", metrics.instrument(memoize(
+            plan_question, ["messages"], ["planned", "branch", "question", "tables", "activities"],
+            ["plan_question"], time_sensitive=True,
+            # A failed or rejected plan (timeout, rate limit) is retried next time instead of pinned for the TTL
+            cache_if=lambda s: s.get("planned", False)
+        )))
+        graph_builder.add_edge(START, "plan_question")
+        graph_builder.add_conditional_edges(
+            "plan_question",
+            lambda s: (
+                "classify_question" if not s.get("planned", False)
+                else "generate_title" if s["branch"] == "data_query" and not s.get("title_exist", False)
+                else "write_query" if s["branch"] == "data_query"
+                else "general_answer"
+            ),
+            {
+                "classify_question": "classify_question",
+                "generate_title": "generate_title",
+                "write_query": "write_query",
+                "general_answer": "general_answer"
+            }
+        )
+    else:
+        graph_builder.add_edge(START, "classify_question")
+
+    graph_builder.add_sequence([metrics.instrument(node) for node in [
+        memoize(give_context, ["messages"], ["question"], ["give_context"], time_sensitive=True),
+        memoize(get_tables, ["question"], ["tables"], ["get_relevant_tables"]),
+        memoize(extract_activities, ["question", "tables"], ["activities"], ["activity_selection"]),
+        memoize(write_query, ["question", "tables", "activities", "top_k", "query_feedback"], ["query"], [
+            "sql-query-system-prompt", "user_input", "window_activity", "session"
+        ]),
+        preflight_query
+    ]])
+    # A too broad query goes back to write_query with a hint (helper.query_plan)
+    graph_builder.add_conditional_edges(
+        "preflight_query",
+        lambda s: "write_query" if s["preflight"].get("strategy") == query_plan.TOO_BROAD else "execute_query",
+        {
+            "write_query": "write_query",
+            "execute_query": "execute_query"
+        }
+    )
+    graph_builder.add_sequence([metrics.instrument(node) for node in [execute_query, generate_answer]])
 
-    graph_builder.add_node("general_answer", general_answer)
+    graph_builder.add_node("general_answer", metrics.instrument(general_answer))
     graph_builder.add_edge("general_answer", END)
 
     graph_builder.add_conditional_edges(
@@ -98,40 +166,121 @@ def initialize():
         }
     )
 
-    graph_builder.add_edge("generate_title", "give_context")
+    graph_builder.add_conditional_edges(
+        "generate_title",
+        lambda s: "write_query" if s.get("planned", False) else "give_context",
+        {
+            "write_query": "write_query",
+            "give_context": "give_context"
+        }
+    )
 
-    conn = sqlite3.connect(str(CHECKPOINT_DB_PATH), check_same_thread=False)
-    checkpointer = SqliteSaver(conn)
+    # AsyncSqliteSaver binds to the running loop, so this has to happen inside it (see server_rest lifespan)
+    conn = await aiosqlite.connect(str(CHECKPOINT_DB_PATH), check_same_thread=False)
+    for pragma in CONNECTION_PRAGMAS:
+        await conn.execute(pragma)
+    checkpointer = AsyncSqliteSaver(conn, serde=metrics.MeasuredSerializer(JsonPlusSerializer()))
     graph = graph_builder.compile(checkpointer=checkpointer)
 
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS chat_metadata (
-            thread_id TEXT PRIMARY KEY,
-            title TEXT,
-            last_activity TEXT
-        )
-    """)
+    # Creates chat_metadata
+    await asyncio.to_thread(get_checkpoint_db)
+
+    # Reads the bundle, and pulls whatever is missing from it, before the first question needs a prompt
+    await asyncio.to_thread(PromptRegistry.preload)
+
+    if settings.PROMPT_HUB_REFRESH:
+        prompt_refresh = asyncio.create_task(asyncio.to_thread(PromptRegistry.refresh))
+
+    if settings.CHECKPOINT_RETENTION_INTERVAL_SECONDS > 0:
+        checkpoint_retention = asyncio.create_task(run_checkpoint_retention())
+
+
+def chat_run(func):
+    """Count a run in active_runs, once a full VACUUM of the checkpoint DB in progress has finished."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        global active_runs
+        async with checkpoint_vacuum:
+            active_runs += 1
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            active_runs -= 1
+    return wrapper
+
+
+async def compact_checkpoints() -> Dict:
+    """
+    Drop all but the latest checkpoint per thread (except threads pending approval) and vacuum the file. A file
+    that still needs its full VACUUM only gets it while no chat is running; otherwise it is reported as pending.
+    """
+    db = get_checkpoint_db()
+    if active_runs == 0 and not await asyncio.to_thread(db.incremental_vacuum_enabled):
+        async with checkpoint_vacuum:
+            # A run that started in the meantime keeps the VACUUM for the next round
+            report = await asyncio.to_thread(db.compact, active_runs == 0)
+    else:
+        report = await asyncio.to_thread(db.compact)
+    metrics.observe_checkpoint_compaction(report["reclaimed_bytes"])
+    return report
+
+
+async def run_checkpoint_retention():
+    # Not at startup: the first chat of the session should not wait for a full VACUUM
+    while True:
+        await asyncio.sleep(settings.CHECKPOINT_RETENTION_INTERVAL_SECONDS)
+        try:
+            await compact_checkpoints()
+        except Exception as e:
+            logging.error(f"[run_checkpoint_retention] Compaction failed: {e}")
+
+
+async def shutdown():
+    if checkpoint_retention:
+        checkpoint_retention.cancel()
+    # aiosqlite runs a non-daemon thread per connection, the process can't exit while it is open
+    await checkpointer.conn.close()
+    get_checkpoint_db().close()
+
+
+async def stream_updates(graph_input, config, chat_id: str, on_update=None, stream_tokens=False, **kwargs):
+    """
+    Iterate the graph's "updates" stream. With stream_tokens, answer tokens are sent to on_update as
+    {"type": "token"} frames while the nodes run; the final message is still assembled and checkpointed as usual.
+    """
+    if not (stream_tokens and on_update):
+        async for step in graph.astream(graph_input, config, stream_mode="updates", **kwargs):
+            yield step
+        return
+
+    async for mode, chunk in graph.astream(graph_input, config, stream_mode=["updates", "messages"], **kwargs):
+        if mode == "updates":
+            yield chunk
+            continue
+
+        message, metadata = chunk
+        if isinstance(message, AIMessageChunk) and message.content and ANSWER_STREAM_TAG in metadata.get("tags", []):
+            await on_update({
+                "type": "token",
+                "chat_id": chat_id,
+                "node": metadata.get("langgraph_node"),
+                "content": message.content
+            })
 
 
-async def run_chat(question: str, chat_id: str, top_k=150, auto_approve=False, on_update=None) -> Dict:
+@metrics.traced("run_chat")
+@chat_run
+async def run_chat(question: str, chat_id: str, top_k=150, auto_approve=False, on_update=None,
+                   stream_tokens=settings.STREAM_TOKENS) -> Dict:
     """Main chat execution."""
     now = datetime.now(UTC).isoformat()
-    conn = sqlite3.connect(str(CHECKPOINT_DB_PATH), check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute("""
-                INSERT INTO chat_metadata (thread_id, last_activity)
-                VALUES (?, ?)
-                ON CONFLICT(thread_id) DO UPDATE SET last_activity = excluded.last_activity
-            """, (chat_id, now))
-    conn.commit()
-    conn.close()
+    await asyncio.to_thread(get_checkpoint_db().touch_chat, chat_id, now)
 
     config = {"configurable": {"thread_id": chat_id}}
     current_time = datetime.now().isoformat()
 
     try:
-        snapshot = graph.get_state(config)
+        snapshot = await graph.aget_state(config)
         messages = snapshot.values.get("messages", [])
     except Exception:
         messages = []
@@ -155,43 +304,54 @@ async def run_chat(question: str, chat_id: str, top_k=150, auto_approve=False, o
         "thread_id": chat_id,
         "messages": messages,
         "question": question,
-        "title_exist": title_exists(chat_id),
+        "title_exist": await asyncio.to_thread(get_checkpoint_db().title_exists, chat_id),
         "branch": "",
         "current_time": current_time,
         "tables": [],
         "activities": [],
         "query": "",
+        "preflight": {},
+        "preflight_retries": 0,
+        "query_feedback": "",
         "raw_result": "",
         "result": [],
+        "truncated": False,
         "answer": "",
-        "top_k": top_k
+        "top_k": top_k,
+        "planned": False
     }
 
     interrupt_nodes = [] if auto_approve else ["generate_answer"]
+    preflight = {}
 
     if on_update:
         await on_update({"type": "step", "node": "classify question"})
 
-    for step in graph.stream(state, config, stream_mode="updates", interrupt_before=interrupt_nodes):
+    async for step in stream_updates(state, config, chat_id, on_update, stream_tokens,
+                                     interrupt_before=interrupt_nodes):
         node_name = list(step.keys())[0]
+        if node_name in ("preflight_query", "execute_query"):
+            preflight = step[node_name].get("preflight") or {}
         if node_name == "execute_query":
             data = step[node_name].get("raw_result")
         if node_name != "__interrupt__":
             step_state = step[node_name]
             branch = step_state.get("branch")
             if on_update:
-                next_step = give_correct_step(node_name, branch, step_state.get('title_exist'))
+                next_step = give_correct_step(node_name, branch, step_state.get('title_exist'),
+                                              step_state.get('planned', False))
                 await on_update({"type": "step", "node": next_step})
-                await asyncio.sleep(0)
 
     answer = state['messages'][-1]
     final_msg = {"role": "ai", "content": answer.content, "additional_kwargs": answer.additional_kwargs}
 
     if branch == 'data_query' and not auto_approve:
+        await asyncio.to_thread(get_checkpoint_db().set_pending_approval, chat_id, True)
         if on_update:
             await on_update({
                 "type": "approval",
                 "data": data,
+                "preflight": {key: value for key, value in preflight.items() if key != "plan"},
                 "chat_id": chat_id
             })
             return {}
@@ -199,12 +359,14 @@ async def run_chat(question: str, chat_id: str, top_k=150, auto_approve=False, o
     return final_msg
 
 
-def resume_stream(chat_id: str) -> Dict:
+@metrics.traced("resume_stream")
+@chat_run
+async def resume_stream(chat_id: str, on_update=None, stream_tokens=settings.STREAM_TOKENS) -> Dict:
     config = {"configurable": {"thread_id": chat_id}}
     final_msg = {}
 
     try:
-        for step in graph.stream(None, config, stream_mode="updates"):
+        async for step in stream_updates(None, config, chat_id, on_update, stream_tokens):
             node_name = list(step.keys())[0]
             step_state = step[node_name]
             answer = step_state.get("messages")[-1]
@@ -213,17 +375,18 @@ def resume_stream(chat_id: str) -> Dict:
                 "content": answer.content,
                 "additional_kwargs": answer.additional_kwargs
             }
+        await asyncio.to_thread(get_checkpoint_db().set_pending_approval, chat_id, False)
         return final_msg
     except Exception as e:
         logging.error(f"[resume_stream] Failed for chat_id={chat_id}: {e}")
         return {"error": "resume failed"}
 
 
-def get_chat_history(chat_id: str) -> Dict:
+async def get_chat_history(chat_id: str) -> Dict:
     config = {"configurable": {"thread_id": chat_id}}
 
     try:
-        snapshot = graph.get_state(config)
+        snapshot = await graph.aget_state(config)
         messages = snapshot.values.get("messages", [])
     except Exception:
         return {"error": "Chat not found"}
@@ -241,17 +404,7 @@ def get_chat_history(chat_id: str) -> Dict:
 
 def delete_chat(chat_id: str):
     try:
-        conn = sqlite3.connect(str(CHECKPOINT_DB_PATH), check_same_thread=False)
-        cursor = conn.cursor()
-
-        cursor.execute("DELETE FROM checkpoints WHERE thread_id = ?", (chat_id,))
-        cursor.execute("DELETE FROM writes WHERE thread_id = ?", (chat_id,))
-
-        cursor.execute("DELETE FROM chat_metadata WHERE thread_id = ?", (chat_id,))
-
-        conn.commit()
-        conn.close()
-
+        get_checkpoint_db().delete_chat(chat_id)
         return {"status": "Chat successfully deleted"}
     except Exception as e:
         return {"error": f"An error occurred: {str(e)}"}
@@ -259,18 +412,7 @@ def delete_chat(chat_id: str):
 
 def rename_chat(chat_id: str, new_title: str):
     try:
-        conn = sqlite3.connect(str(CHECKPOINT_DB_PATH), check_same_thread=False)
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            UPDATE chat_metadata
-            SET title = ?
-            WHERE thread_id = ?
-        """, (new_title.strip(), chat_id))
-
-        conn.commit()
-        conn.close()
-
+        get_checkpoint_db().set_title(chat_id, new_title)
         return {"status": f"Chat title updated to '{new_title.strip()}'"}
     except Exception as e:
         return {"error": f"An error occurred: {str(e)}"}
@@ -0,0 +1,465 @@
+import base64
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, UTC
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+APPDATA_PATH = Path(os.getenv("APPDATA", Path.home()))
+CHECKPOINT_DB_PATH = APPDATA_PATH / "personal-query" / "chat_checkpoints.db"
+
+BUSY_TIMEOUT_MS = 5000
+# Ids handed out by POST /chats that never got a message are released after this long
+RESERVATION_TTL = timedelta(days=1)
+# Pages returned to the file system per PRAGMA incremental_vacuum step; the write lock is released in between
+VACUUM_STEP_PAGES = 1024
+
+# Applied to every connection to the checkpoint DB, including the one owned by the LangGraph checkpointer.
+# auto_vacuum comes first: on a new, empty file it takes effect right away, an existing file is switched over
+# by compact() once it has been pruned.
+CONNECTION_PRAGMAS = [
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+]
+
+
+class CheckpointDB:
+    """
+    Owner of chat_checkpoints.db. Reads go through a small pool of connections (WAL lets them run next to a
+    writer), all writes go through a single connection serialized by a lock, so they never contend for the
+    database lock among themselves.
+    """
+
+    def __init__(self, path: Path = CHECKPOINT_DB_PATH, max_readers: int = 4):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._writer = self._connect()
+        self._write_lock = threading.Lock()
+
+        self._readers: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._max_readers = max_readers
+        self._reader_count = 0
+        self._reader_lock = threading.Lock()
+
+        self.ensure_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=BUSY_TIMEOUT_MS / 1000)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def read(self) -> Iterator[sqlite3.Cursor]:
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            with self._reader_lock:
+                create = self._reader_count < self._max_readers
+                if create:
+                    self._reader_count += 1
+            conn = self._connect() if create else self._readers.get()
+
+        try:
+            yield conn.cursor()
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    @contextmanager
+    def write(self) -> Iterator[sqlite3.Cursor]:
+        with self._write_lock:
+            cursor = self._writer.cursor()
+            try:
+                yield cursor
+                self._writer.commit()
+            except Exception:
+                self._writer.rollback()
+                raise
+
+    def close(self):
+        with self._write_lock:
+            self._writer.close()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def ensure_schema(self):
+        with self.write() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS chat_metadata (
+                    thread_id TEXT PRIMARY KEY,
+                    title TEXT,
+                    last_activity TEXT
+                )
+            """)
+
+            # PRAGMA user_version counts the migrations already applied to this file
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            for i, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                migration(self, cursor)
+                cursor.execute(f"PRAGMA user_version = {i}")
+
+    def has_checkpoints_table(self, cursor: sqlite3.Cursor) -> bool:
+        cursor.execute("""
+            SELECT name FROM sqlite_master
+            WHERE type='table' AND name='checkpoints'
+        """)
+        return cursor.fetchone() is not None
+
+    def touch_chat(self, thread_id: str, now: str):
+        with self.write() as cursor:
+            cursor.execute("""
+                INSERT INTO chat_metadata (thread_id, last_activity, status)
+                VALUES (?, ?, 'active')
+                ON CONFLICT(thread_id) DO UPDATE
+                SET last_activity = excluded.last_activity, status = 'active', pending_approval = 0
+            """, (thread_id, now))
+
+    def set_pending_approval(self, thread_id: str, pending: bool):
+        """Threads waiting for approval keep all their checkpoints (see prune_checkpoints)."""
+        with self.write() as cursor:
+            cursor.execute("""
+                UPDATE chat_metadata
+                SET pending_approval = ?
+                WHERE thread_id = ?
+            """, (int(pending), thread_id))
+
+    def set_title(self, thread_id: str, title: str):
+        with self.write() as cursor:
+            cursor.execute("""
+                UPDATE chat_metadata
+                SET title = ?
+                WHERE thread_id = ?
+            """, (title.strip(), thread_id))
+
+    def title_exists(self, thread_id: str) -> bool:
+        with self.read() as cursor:
+            cursor.execute("""
+                SELECT title FROM chat_metadata
+                WHERE thread_id = ?
+                LIMIT 1
+            """, (thread_id,))
+            row = cursor.fetchone()
+
+        if not row or row[0] is None:
+            return False
+
+        return bool(row[0].strip())
+
+    def get_next_thread_id(self) -> str:
+        """
+        Allocate a new thread id and reserve its chat_metadata row; it becomes listed with its first message.
+        Ids a client already used without POST /chats are skipped, reservations older than RESERVATION_TTL
+        are released.
+        """
+        now = datetime.now(UTC)
+        with self.write() as cursor:
+            cursor.execute("""
+                DELETE FROM chat_metadata
+                WHERE status = 'reserved' AND (last_activity IS NULL OR last_activity < ?)
+            """, ((now - RESERVATION_TTL).isoformat(),))
+
+            has_checkpoints = self.has_checkpoints_table(cursor)
+            while True:
+                cursor.execute("""
+                    UPDATE thread_sequence SET next_id = next_id + 1
+                    WHERE id = 1
+                    RETURNING next_id - 1
+                """)
+                thread_id = str(cursor.fetchone()[0])
+                in_use = cursor.execute(
+                    "SELECT 1 FROM chat_metadata WHERE thread_id = ?", (thread_id,)
+                ).fetchone()
+                if not in_use and has_checkpoints:
+                    in_use = cursor.execute(
+                        "SELECT 1 FROM checkpoints WHERE thread_id = ? LIMIT 1", (thread_id,)
+                    ).fetchone()
+                if not in_use:
+                    break
+
+            # last_activity of a reservation is when it was made, touch_chat overwrites it
+            cursor.execute("""
+                INSERT INTO chat_metadata (thread_id, last_activity, status)
+                VALUES (?, ?, 'reserved')
+            """, (thread_id, now.isoformat()))
+
+        return thread_id
+
+    def list_chats(self, limit: Optional[int] = None, cursor: Optional[str] = None,
+                   order: str = "desc") -> Tuple[List[Dict[str, Optional[str]]], Optional[str]]:
+        """
+        One page of chats ordered by last_activity (then thread_id), newest first unless order is "asc".
+        Served from chat_metadata alone. Returns the page and the cursor for the next one (None on the last page).
+        """
+        descending = order != "asc"
+        direction = "DESC" if descending else "ASC"
+        where, params = "", []
+
+        if cursor:
+            last_activity, thread_id = decode_cursor(cursor)
+            # NULLs sort first ascending and last descending
+            if last_activity is None:
+                where = (
+                    "AND last_activity IS NULL AND thread_id < ?" if descending
+                    else "AND ((last_activity IS NULL AND thread_id > ?) OR last_activity IS NOT NULL)"
+                )
+                params = [thread_id]
+            else:
+                op = "<" if descending else ">"
+                where = f"last_activity {op} ? OR (last_activity = ? AND thread_id {op} ?)"
+                params = [last_activity, last_activity, thread_id]
+                if descending:
+                    where += " OR last_activity IS NULL"
+                where = f"AND ({where})"
+
+        query = f"""
+            SELECT thread_id, title, last_activity FROM chat_metadata
+            WHERE status = 'active' {where}
+            ORDER BY last_activity {direction}, thread_id {direction}
+        """
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit + 1)
+
+        with self.read() as cur:
+            rows = cur.execute(query, params).fetchall()
+
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][2], rows[-1][0])
+
+        chats = [{
+            "id": tid,
+            "title": title.strip() if title and title.strip() else f"New Chat [{tid}]",
+            "last_activity": last_activity or None
+        } for tid, title, last_activity in rows]
+
+        return chats, next_cursor
+
+    def is_new_chat(self, thread_id: str) -> bool:
+        with self.read() as cursor:
+            if not self.has_checkpoints_table(cursor):
+                return True
+
+            cursor.execute("""
+                SELECT 1 FROM checkpoints
+                WHERE thread_id = ?
+                LIMIT 1
+            """, (thread_id,))
+            return cursor.fetchone() is None
+
+    def delete_chat(self, thread_id: str):
+        with self.write() as cursor:
+            cursor.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+            cursor.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+            cursor.execute("DELETE FROM chat_metadata WHERE thread_id = ?", (thread_id,))
+
+    def prune_checkpoints(self) -> Tuple[int, int]:
+        """
+        Keep only the latest checkpoint of every thread, all of them for threads pending approval, and drop the
+        writes whose checkpoint is gone. One transaction per thread, so the checkpointer is never blocked for long.
+        Returns the number of checkpoints and writes deleted.
+        """
+        with self.read() as cursor:
+            if not self.has_checkpoints_table(cursor):
+                return 0, 0
+            threads = [row[0] for row in cursor.execute("""
+                SELECT thread_id FROM checkpoints
+                WHERE thread_id NOT IN (SELECT thread_id FROM chat_metadata WHERE pending_approval)
+                GROUP BY thread_id
+                HAVING COUNT(*) > COUNT(DISTINCT checkpoint_ns)
+            """)]
+
+        checkpoints = writes = 0
+        for thread_id in threads:
+            with self.write() as cursor:
+                # A thread can turn pending since it was listed
+                cursor.execute("""
+                    DELETE FROM checkpoints
+                    WHERE thread_id = ?
+                    AND NOT EXISTS (SELECT 1 FROM chat_metadata WHERE thread_id = ? AND pending_approval)
+                    AND checkpoint_id < (
+                        SELECT MAX(latest.checkpoint_id) FROM checkpoints AS latest
+                        WHERE latest.thread_id = checkpoints.thread_id
+                        AND latest.checkpoint_ns = checkpoints.checkpoint_ns
+                    )
+                """, (thread_id, thread_id))
+                checkpoints += cursor.rowcount
+
+        with self.write() as cursor:
+            cursor.execute("""
+                DELETE FROM writes
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM checkpoints
+                    WHERE checkpoints.thread_id = writes.thread_id
+                    AND checkpoints.checkpoint_ns = writes.checkpoint_ns
+                    AND checkpoints.checkpoint_id = writes.checkpoint_id
+                )
+            """)
+            writes = cursor.rowcount
+
+        return checkpoints, writes
+
+    def incremental_vacuum(self, step_pages: int = VACUUM_STEP_PAGES) -> int:
+        """Return the free pages to the file system a step at a time. Returns the bytes freed."""
+        freed = 0
+        while True:
+            with self.write() as cursor:
+                page_size = cursor.execute("PRAGMA page_size").fetchone()[0]
+                before = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+                if not before:
+                    break
+                cursor.execute(f"PRAGMA incremental_vacuum({step_pages})").fetchall()
+                after = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+            if after >= before:
+                break  # auto_vacuum is not INCREMENTAL on this file
+            freed += (before - after) * page_size
+
+        # The file only shrinks once the WAL is checkpointed; busy readers just postpone that
+        with self.write() as cursor:
+            cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        return freed
+
+    def file_size(self) -> int:
+        return sum(
+            Path(str(self.path) + suffix).stat().st_size
+            for suffix in ("", "-wal")
+            if Path(str(self.path) + suffix).exists()
+        )
+
+    def incremental_vacuum_enabled(self) -> bool:
+        with self._write_lock:
+            # Asked on the writer: the pooled readers can still report the mode they were opened with
+            return self._writer.execute("PRAGMA auto_vacuum").fetchone()[0] == 2  # INCREMENTAL
+
+    def switch_to_incremental_vacuum(self):
+        """
+        One full VACUUM that rewrites the file with auto_vacuum=INCREMENTAL. It holds the write lock for as long
+        as it copies the file, so it is only run while no chat is running (chat_engine.compact_checkpoints) and
+        after prune_checkpoints. The header records the switch only if it succeeds.
+        """
+        with self._write_lock:
+            if self._writer.in_transaction:
+                self._writer.commit()
+            self._writer.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self._writer.execute("VACUUM")
+
+    def compact(self, full_vacuum: bool = False) -> Dict[str, Any]:
+        """
+        Prune old checkpoints and orphaned writes, then vacuum. A file that predates auto_vacuum=INCREMENTAL is
+        only shrunk with full_vacuum, which switches it over; until then it is pruned and reported as "pending".
+        Returns what was deleted and reclaimed.
+        """
+        size_before = self.file_size()
+        checkpoints, writes = self.prune_checkpoints()
+        freed = 0
+        if self.incremental_vacuum_enabled():
+            vacuum = "incremental"
+            freed = self.incremental_vacuum()
+        elif full_vacuum:
+            vacuum = "full"
+            self.switch_to_incremental_vacuum()
+        else:
+            vacuum = "pending"
+        size_after = self.file_size()
+        report = {
+            "checkpoints_deleted": checkpoints,
+            "writes_deleted": writes,
+            "vacuum": vacuum,
+            "freed_bytes": freed,
+            "file_bytes_before": size_before,
+            "file_bytes_after": size_after,
+            "reclaimed_bytes": max(size_before - size_after, 0),
+        }
+        logging.info(f"[compact] Checkpoint DB compacted: {report}")
+        return report
+
+
+def encode_cursor(last_activity: Optional[str], thread_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([last_activity, thread_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[str], str]:
+    try:
+        last_activity, thread_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    return last_activity, thread_id
+
+
+def _migrate_chat_listing(db: CheckpointDB, cursor: sqlite3.Cursor):
+    """Listing reads chat_metadata only: index it and add rows for chats that only exist in checkpoints."""
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_metadata_last_activity
+        ON chat_metadata(last_activity, thread_id)
+    """)
+    if db.has_checkpoints_table(cursor):
+        cursor.execute("""
+            INSERT OR IGNORE INTO chat_metadata (thread_id)
+            SELECT DISTINCT thread_id FROM checkpoints
+        """)
+
+
+def _migrate_thread_sequence(db: CheckpointDB, cursor: sqlite3.Cursor):
+    """Thread ids come from a single-row sequence, seeded once from the numeric ids already in use."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS thread_sequence (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            next_id INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("ALTER TABLE chat_metadata ADD COLUMN status TEXT NOT NULL DEFAULT 'active'")
+
+    # chat_metadata already holds every thread from checkpoints (see _migrate_chat_listing)
+    cursor.execute("""
+        INSERT OR IGNORE INTO thread_sequence (id, next_id)
+        SELECT 1, COALESCE(MAX(CAST(thread_id AS INTEGER)), 0) + 1
+        FROM chat_metadata
+        WHERE thread_id != '' AND thread_id NOT GLOB '*[^0-9]*'
+    """)
+
+
+def _migrate_pending_approval(db: CheckpointDB, cursor: sqlite3.Cursor):
+    """Flag for threads interrupted before generate_answer, whose checkpoints retention has to keep."""
+    cursor.execute("ALTER TABLE chat_metadata ADD COLUMN pending_approval INTEGER NOT NULL DEFAULT 0")
+
+
+def _migrate_incremental_vacuum(db: CheckpointDB, cursor: sqlite3.Cursor):
+    """
+    Nothing to do at startup: the switch to auto_vacuum=INCREMENTAL needs a full VACUUM, which compact() runs in
+    the background after pruning (see switch_to_incremental_vacuum). Kept so user_version numbers stay the same.
+    """
+
+
+MIGRATIONS = [
+    _migrate_chat_listing,
+    _migrate_thread_sequence,
+    _migrate_pending_approval,
+    _migrate_incremental_vacuum,
+]
+
+_instance: Optional[CheckpointDB] = None
+_instance_lock = threading.Lock()
+
+
+def get_checkpoint_db() -> CheckpointDB:
+    global _instance
+    with _instance_lock:
+        if _instance is None:
+            _instance = CheckpointDB()
+        return _instance
@@ -1,32 +1,97 @@
 import os
 import sqlite3
+import threading
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-from langchain_community.utilities import SQLDatabase
-from sqlalchemy import create_engine
-from sqlalchemy.pool import StaticPool
+if TYPE_CHECKING:
+    from langchain_community.utilities import SQLDatabase
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 APPDATA_PATH = Path(os.getenv("APPDATA", Path.home()))
 DB_PATH = APPDATA_PATH / "personal-query" / "database.sqlite"
+# Indexed copy of the tracker DB (helper.replica) that queries run against once it has been built
+ANALYTICS_DB_PATH = APPDATA_PATH / "personal-query" / "analytics.sqlite"
+# Derived aggregates of the tracker DB (helper.rollups), attached as "rollups" to the query connections
+ROLLUPS_DB_PATH = APPDATA_PATH / "personal-query" / "rollups.sqlite"
 
 DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 
-readonly_connection = sqlite3.connect(
-    f"file:{DB_PATH}?mode=ro",
-    uri=True,
-    check_same_thread=False
-)
+# Cleared by helper.data_refresh while the replica and rollups could not be brought up to date with the tracker DB
+_derived_data_current = True
 
-engine = create_engine(
-    "sqlite://",
-    creator=lambda: readonly_connection,
-    poolclass=StaticPool,
-    connect_args={"check_same_thread": False},
-)
 
-_db_instance = SQLDatabase(engine)
+def set_derived_data_current(current: bool):
+    global _derived_data_current
+    _derived_data_current = current
 
 
-def get_db() -> SQLDatabase:
-    return _db_instance
+def derived_data_current() -> bool:
+    return _derived_data_current
+
+
+def attach_rollups(conn: sqlite3.Connection) -> bool:
+    """Attach the rollup DB read-only once it exists. Its tables resolve without the "rollups." prefix."""
+    if any(row[1] == "rollups" for row in conn.execute("PRAGMA database_list")):
+        return True
+    if not ROLLUPS_DB_PATH.exists():
+        return False
+    conn.execute("ATTACH DATABASE ? AS rollups", (f"file:{ROLLUPS_DB_PATH}?mode=ro",))
+    return True
+
+
+def query_db_path() -> Path:
+    """The analytics replica once it exists and is up to date, the tracker DB otherwise."""
+    return ANALYTICS_DB_PATH if _derived_data_current and ANALYTICS_DB_PATH.exists() else DB_PATH
+
+
+def connect_readonly(path: Path = None) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        f"file:{path or query_db_path()}?mode=ro",
+        uri=True,
+        check_same_thread=False
+    )
+    attach_rollups(conn)
+    return conn
+
+
+# Shared read-only connection and SQLDatabase per database file, created on first use
+_instances: dict[Path, tuple[sqlite3.Connection, "SQLDatabase"]] = {}
+_instances_lock = threading.Lock()
+
+
+def _get_instance(path: Path) -> tuple[sqlite3.Connection, "SQLDatabase"]:
+    with _instances_lock:
+        if path not in _instances:
+            # SQLAlchemy and langchain_community are slow to import and not needed until the first query
+            from langchain_community.utilities import SQLDatabase
+            from sqlalchemy import create_engine
+            from sqlalchemy.pool import StaticPool
+
+            readonly_connection = connect_readonly(path)
+            engine = create_engine(
+                "sqlite://",
+                creator=lambda: readonly_connection,
+                poolclass=StaticPool,
+                connect_args={"check_same_thread": False},
+            )
+            _instances[path] = readonly_connection, SQLDatabase(engine)
+        return _instances[path]
+
+
+def get_db() -> "SQLDatabase":
+    return _get_instance(query_db_path())[1]
+
+
+def get_readonly_connection() -> sqlite3.Connection:
+    return _get_instance(query_db_path())[0]
+
+
+def get_data_version() -> tuple:
+    """Changes whenever another connection commits to the queried or rollup database (PRAGMA data_version)."""
+    path = query_db_path()
+    readonly_connection = get_readonly_connection()
+    versions = [path.name, readonly_connection.execute("PRAGMA data_version").fetchone()[0]]
+    if attach_rollups(readonly_connection):
+        versions.append(readonly_connection.execute("PRAGMA rollups.data_version").fetchone()[0])
+    return tuple(versions)
@@ -1,11 +1,11 @@
 import sqlite3
 import shutil
 
-from langchain import hub
 from langchain_core.prompts import ChatPromptTemplate
 
 from database import APPDATA_PATH
 from helper.env_loader import load_env
+from prompt_registry import PromptRegistry
 
 DB_PATH = APPDATA_PATH / "personal-analytics" / "database.sqlite"
 BACKUP_PATH = APPDATA_PATH / "personal-analytics" / "database_cut_columns.sqlite"
@@ -71,6 +71,7 @@ def copy_db_and_trim_columns():
 #print(db.get_table_info())
 
 
-load_env()
-ui_template: ChatPromptTemplate = hub.pull("user_input")
-print(type(ui_template.messages[0].prompt.template))
+if __name__ == "__main__":
+    load_env()
+    ui_template: ChatPromptTemplate = PromptRegistry.get("user_input")
+    print(type(ui_template.messages[0].prompt.template))
@@ -0,0 +1,73 @@
+import logging
+import os
+import threading
+import time
+
+import database
+import settings
+from database import ANALYTICS_DB_PATH, DB_PATH, ROLLUPS_DB_PATH
+from helper.db_modification import update_sessions_from_usage_data, add_window_activity_durations
+from helper.replica import sync_replica
+from helper.rollups import refresh_rollups
+
+_lock = threading.Lock()
+# Signature of the tracker DB after the last refresh, and when ensure_fresh last compared it
+_refreshed_signature = None
+_checked_at = 0.0
+
+
+def source_signature(db_path) -> tuple:
+    """Size and modification time of the tracker DB and its WAL, they change with every commit to it."""
+    signature = []
+    for suffix in ("", "-wal"):
+        try:
+            stat = os.stat(f"{db_path}{suffix}")
+            signature += [stat.st_size, stat.st_mtime_ns]
+        except FileNotFoundError:
+            signature += [None, None]
+    return tuple(signature)
+
+
+def _refresh(db_path):
+    global _refreshed_signature
+    update_sessions_from_usage_data(db_path)
+    add_window_activity_durations(db_path)
+    sync_replica(db_path)
+    refresh_rollups(db_path)
+    # Taken after the steps above, which write to the tracker DB themselves
+    _refreshed_signature = source_signature(db_path)
+
+
+def refresh_derived_data(db_path=DB_PATH):
+    """Derive sessions and window durations in the tracker DB, then bring the replica and rollups up to date."""
+    with _lock:
+        _refresh(db_path)
+        database.set_derived_data_current(True)
+
+
+def ensure_fresh(db_path=DB_PATH):
+    """
+    Run before generated queries: refresh the replica and rollups if the tracker kept writing since the last
+    refresh, compared at most every DATA_REFRESH_INTERVAL_SECONDS. Nothing to do until /initialize-data built
+    them. If the refresh fails, queries read the tracker DB and the rollups are not offered to the model until
+    a later one succeeds.
+    """
+    global _checked_at
+    if not ANALYTICS_DB_PATH.exists() and not ROLLUPS_DB_PATH.exists():
+        return
+
+    with _lock:
+        now = time.monotonic()
+        if now - _checked_at < settings.DATA_REFRESH_INTERVAL_SECONDS:
+            return
+        _checked_at = now
+        if source_signature(db_path) == _refreshed_signature:
+            return
+
+        try:
+            _refresh(db_path)
+        except Exception as e:
+            logging.warning(f"[ensure_fresh] Replica and rollup refresh failed, querying the tracker DB: {e}")
+            database.set_derived_data_current(False)
+            return
+        database.set_derived_data_current(True)
@@ -1,12 +1,77 @@
 import sqlite3
-from datetime import datetime
 
+from helper.sync_state import get_watermark, set_watermark
 
-def parse_datetime_no_ms(dt_str):
-    return datetime.strptime(dt_str, "%Y-%m-%d %H:%M:%S")
 
+SESSION_WATERMARK = 'session_usage_data'
 
-def update_sessions_from_usage_data(db_path):
+# Truncated promptedAt, must match the expression of idx_esr_prompted_at_trunc for the index to be used
+PROMPTED_AT_TRUNC = "substr(promptedAt, 1, instr(promptedAt || '.', '.') - 1)"
+
+# A session ends at every EXPERIENCE_SAMPLING_AUTOMATICALLY_OPENED and APP_QUIT that happens while the
+# app is running, i.e. when the last APP_START/APP_QUIT before it was an APP_START. It starts at the
+# previous event. Boundaries are encoded as seq * 2 (+ 1 for APP_START) so MAX() finds the latest one.
+SESSIONS_UPSERT_SQL = f'''
+    WITH events AS (
+        SELECT id, created_at, type,
+               ROW_NUMBER() OVER (ORDER BY created_at, rowid) AS seq
+        FROM usage_data
+        WHERE type IN ('APP_START', 'EXPERIENCE_SAMPLING_AUTOMATICALLY_OPENED', 'APP_QUIT')
+          AND created_at >= :since
+    ),
+    flagged AS (
+        SELECT id, created_at, type,
+               LAG(created_at) OVER w AS prev_at,
+               MAX(CASE WHEN type = 'APP_START' THEN seq * 2 + 1
+                        WHEN type = 'APP_QUIT' THEN seq * 2 END)
+                   OVER (w ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) AS last_boundary
+        FROM events
+        WINDOW w AS (ORDER BY seq)
+    )
+    INSERT INTO session (
+        id, startedAt, endedAt, durationInSeconds,
+        question, scale, response, skipped
+    )
+    SELECT f.id,  -- use usage_data ID as session ID
+           f.prev_at,
+           f.created_at,
+           CAST(ROUND((julianday(f.created_at) - julianday(f.prev_at)) * 86400) AS INTEGER),
+           CASE esr.question
+               WHEN 'Compared to your normal level of productivity, how productive do you consider the previous session?'
+                   THEN 'How productive was this session?'
+               WHEN 'How well did you spend your time in the previous session?'
+                   THEN 'How well spent time?'
+               ELSE esr.question
+           END,
+           esr.scale,
+           esr.response,
+           esr.skipped
+    FROM flagged f
+    LEFT JOIN experience_sampling_responses esr
+        ON f.type = 'EXPERIENCE_SAMPLING_AUTOMATICALLY_OPENED'
+        AND esr.rowid = (
+            SELECT MAX(rowid) FROM experience_sampling_responses
+            WHERE {PROMPTED_AT_TRUNC} = f.created_at
+        )
+    WHERE f.type != 'APP_START' AND f.last_boundary % 2 = 1
+    ON CONFLICT(id) DO UPDATE SET
+        startedAt = excluded.startedAt,
+        endedAt = excluded.endedAt,
+        durationInSeconds = excluded.durationInSeconds,
+        question = excluded.question,
+        scale = excluded.scale,
+        response = excluded.response,
+        skipped = excluded.skipped
+'''
+
+
+def update_sessions_from_usage_data(db_path, incremental=True):
+    """
+    Derive sessions from usage_data.
+
+    In incremental mode derivation restarts at the last APP_START/APP_QUIT at or before the watermark,
+    since whether an event closes a session depends on the app state at that point.
+    """
     conn = sqlite3.connect(str(db_path), check_same_thread=False)
     cur = conn.cursor()
 
@@ -23,141 +88,100 @@ def update_sessions_from_usage_data(db_path):
             skipped BOOLEAN
         )
     ''')
-
-    # Load usage data (ordered chronologically)
-    cur.execute('''
-        SELECT id, created_at, type FROM usage_data
-        WHERE type IN ('APP_START', 'EXPERIENCE_SAMPLING_AUTOMATICALLY_OPENED', 'APP_QUIT')
-        ORDER BY created_at ASC
-    ''')
-    usage_rows = cur.fetchall()
-
-    # Load responses into a dict (truncated promptedAt -> row)
-    cur.execute('''
-        SELECT id, promptedAt, question, scale, response, skipped
-        FROM experience_sampling_responses
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_usage_data_type_created_at ON usage_data(type, created_at)')
+    cur.execute(f'''
+        CREATE INDEX IF NOT EXISTS idx_esr_prompted_at_trunc
+        ON experience_sampling_responses({PROMPTED_AT_TRUNC})
     ''')
-    esr_raw = cur.fetchall()
-    esr_map = {
-        promptedAt.split('.')[0]: (id_, question, scale, response, skipped)
-        for (id_, promptedAt, question, scale, response, skipped) in esr_raw
-    }
-
-    sessions = []
-    current_start = None
-
-    for i, (uid, created_at, typ) in enumerate(usage_rows):
-        if typ == 'APP_START':
-            current_start = created_at
-
-        elif typ == 'EXPERIENCE_SAMPLING_AUTOMATICALLY_OPENED' and current_start:
-            started_dt = parse_datetime_no_ms(current_start)
-            ended_dt = parse_datetime_no_ms(created_at)
-            duration = int((ended_dt - started_dt).total_seconds())
-
-            esr = esr_map.get(created_at)
-            esr_id, question, scale, response, skipped = esr if esr else (None, None, None, None, None)
-
-            if question == "Compared to your normal level of productivity, how productive do you consider the previous session?":
-                question = "How productive was this session?"
-            elif question == "How well did you spend your time in the previous session?":
-                question = "How well spent time?"
-
-            sessions.append((
-                uid,  # use usage_data ID as session ID
-                current_start,
-                created_at,
-                duration,
-                question,
-                scale,
-                response,
-                skipped
-            ))
-
-            current_start = created_at
-
-        elif typ == 'APP_QUIT' and current_start:
-            started_dt = parse_datetime_no_ms(current_start)
-            ended_dt = parse_datetime_no_ms(created_at)
-            duration = int((ended_dt - started_dt).total_seconds())
-
-            sessions.append((
-                uid,
-                current_start,
-                created_at,
-                duration,
-                None, None, None, None
-            ))
-
-            current_start = None  # session ends
-
-    # Load existing session IDs to avoid duplicates
-    cur.execute('SELECT id FROM session')
-    existing_ids = set(row[0] for row in cur.fetchall())
-
-    for session in sessions:
-        if session[0] in existing_ids:
-            continue
 
+    since = ''
+    watermark = get_watermark(cur, SESSION_WATERMARK) if incremental else None
+    if watermark is not None:
         cur.execute('''
-            INSERT INTO session (
-                id, startedAt, endedAt, durationInSeconds,
-                question, scale, response, skipped
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', session)
+            SELECT MAX(created_at) FROM usage_data
+            WHERE type IN ('APP_START', 'APP_QUIT') AND created_at <= ?
+        ''', (watermark,))
+        since = cur.fetchone()[0] or ''
 
+    cur.execute(SESSIONS_UPSERT_SQL, {"since": since})
     cur.execute('DELETE FROM session WHERE durationInSeconds IS NOT NULL AND durationInSeconds < 300')
+
+    cur.execute('''
+        SELECT MAX(created_at) FROM usage_data
+        WHERE type IN ('APP_START', 'EXPERIENCE_SAMPLING_AUTOMATICALLY_OPENED', 'APP_QUIT')
+    ''')
+    set_watermark(cur, SESSION_WATERMARK, cur.fetchone()[0])
+
     conn.commit()
     conn.close()
 
 
-def add_window_activity_durations(db_path):
+WINDOW_ACTIVITY_WATERMARK = 'window_activity_durations'
+
+# Duration of each window until the next one (LEAD). When the next window starts on a later day,
+# the APP_QUIT of that day cuts the duration; the last window only gets a duration from an APP_QUIT.
+# Durations are truncated to whole seconds, computed via milliseconds to avoid julianday float noise.
+WINDOW_ACTIVITY_DURATIONS_SQL = '''
+    WITH quits AS (
+        SELECT date(created_at) AS day, MAX(created_at) AS quit_at
+        FROM usage_data
+        WHERE type = 'APP_QUIT'
+        GROUP BY date(created_at)
+    ),
+    ordered AS (
+        SELECT rowid AS rid, ts, LEAD(ts) OVER (ORDER BY ts) AS next_ts
+        FROM window_activity
+        WHERE ts >= ?
+    ),
+    bounded AS (
+        SELECT o.rid, o.ts,
+               CASE
+                   WHEN o.next_ts IS NULL THEN
+                       CASE WHEN julianday(q.quit_at) > julianday(o.ts) THEN q.quit_at END
+                   WHEN date(o.ts) != date(o.next_ts)
+                        AND julianday(q.quit_at) > julianday(o.ts)
+                        AND julianday(q.quit_at) < julianday(o.next_ts) THEN q.quit_at
+                   ELSE o.next_ts
+               END AS end_ts
+        FROM ordered o
+        LEFT JOIN quits q ON q.day = date(o.ts)
+    )
+    SELECT CAST(ROUND((julianday(end_ts) - julianday(ts)) * 86400000) AS INTEGER) / 1000, rid
+    FROM bounded
+'''
+
+
+def add_window_activity_durations(db_path, incremental=True):
+    """
+    Compute window_activity.durationInSeconds.
+
+    In incremental mode only rows from the last processed timestamp onward are recomputed; the row at
+    the watermark is included again because its successor (or APP_QUIT) may only have arrived now.
+    """
     conn = sqlite3.connect(str(db_path), check_same_thread=False)
     cur = conn.cursor()
 
     # Try to add column
     try:
         cur.execute('ALTER TABLE window_activity ADD COLUMN durationInSeconds INTEGER')
+        incremental = False  # Fresh column, nothing computed yet
     except sqlite3.OperationalError:
         pass  # Column exists
 
-    # Clear existing values
-    cur.execute('UPDATE window_activity SET durationInSeconds = NULL')
-
-    # Load window activity
-    cur.execute('SELECT rowid, ts FROM window_activity ORDER BY ts ASC')
-    rows = cur.fetchall()
-
-    # Load APP_QUITs
-    cur.execute('SELECT created_at FROM usage_data WHERE type = "APP_QUIT"')
-    app_quits = [datetime.fromisoformat(row[0]) for row in cur.fetchall()]
-    app_quit_by_day = {q.date(): q for q in app_quits}
-
-    for i in range(len(rows) - 1):
-        current_rowid, current_ts = rows[i]
-        next_ts = rows[i + 1][1]
-
-        start_dt = datetime.fromisoformat(current_ts)
-        end_dt = datetime.fromisoformat(next_ts)
-
-        # If next window is on next day, check for APP_QUIT cutoff
-        if start_dt.date() != end_dt.date():
-            quit_dt = app_quit_by_day.get(start_dt.date())
-            if quit_dt and start_dt < quit_dt < end_dt:
-                end_dt = quit_dt  # override end time
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_window_activity_ts ON window_activity(ts)')
 
-        duration = int((end_dt - start_dt).total_seconds())
-        cur.execute('UPDATE window_activity SET durationInSeconds = ? WHERE rowid = ?', (duration, current_rowid))
+    watermark = get_watermark(cur, WINDOW_ACTIVITY_WATERMARK) if incremental else None
+    if watermark is None:
+        # Clear existing values
+        cur.execute('UPDATE window_activity SET durationInSeconds = NULL')
 
-    # Handle last row with APP_QUIT if available
-    if rows:
-        last_rowid, last_ts = rows[-1]
-        start_dt = datetime.fromisoformat(last_ts)
-        quit_dt = app_quit_by_day.get(start_dt.date())
+    # Fully read before writing back, the SELECT must not observe its own updates
+    cur.execute(WINDOW_ACTIVITY_DURATIONS_SQL, (watermark or '',))
+    updates = cur.fetchall()
+    cur.executemany('UPDATE window_activity SET durationInSeconds = ? WHERE rowid = ?', updates)
 
-        if quit_dt and quit_dt > start_dt:
-            duration = int((quit_dt - start_dt).total_seconds())
-            cur.execute('UPDATE window_activity SET durationInSeconds = ? WHERE rowid = ?', (duration, last_rowid))
+    cur.execute('SELECT MAX(ts) FROM window_activity')
+    set_watermark(cur, WINDOW_ACTIVITY_WATERMARK, cur.fetchone()[0])
 
     conn.commit()
     conn.close()
@@ -0,0 +1,162 @@
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Optional
+
+from langchain_core.load import dumpd
+from langchain_core.messages import BaseMessage, SystemMessage
+
+import metrics
+import settings
+from llm_registry import LLMRegistry
+from prompt_registry import PromptRegistry
+
+APPDATA_PATH = Path(os.getenv("APPDATA", Path.home()))
+LLM_CACHE_DB_PATH = APPDATA_PATH / "personal-query" / "llm_cache.db"
+
+
+class StepCache:
+    """SQLite-backed store of pipeline step outputs with TTL and LRU eviction by entry count."""
+
+    def __init__(self, db_path: Path, ttl_seconds: int, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._puts = 0
+
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS step_cache (
+                key TEXT PRIMARY KEY,
+                step TEXT,
+                value TEXT,
+                created_at REAL,
+                last_used REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_step_cache_last_used ON step_cache(last_used)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM step_cache WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE step_cache SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, step: str, value: dict):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO step_cache (key, step, value, created_at, last_used) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value,
+                    created_at = excluded.created_at, last_used = excluded.last_used
+            """, (key, step, json.dumps(value), now, now))
+            self._puts += 1
+            if self._puts % 100 == 1:
+                self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        self._conn.execute("DELETE FROM step_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        self._conn.execute("""
+            DELETE FROM step_cache WHERE key IN (
+                SELECT key FROM step_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM step_cache")
+            self._conn.commit()
+
+
+_cache: Optional[StepCache] = None
+
+
+def get_step_cache() -> StepCache:
+    global _cache
+    if _cache is None:
+        _cache = StepCache(LLM_CACHE_DB_PATH, settings.LLM_CACHE_TTL_SECONDS, settings.LLM_CACHE_MAX_ENTRIES)
+    return _cache
+
+
+def _fingerprint(value):
+    if isinstance(value, BaseMessage):
+        return [value.type, value.content]
+    if isinstance(value, list):
+        # The leading system message is swapped per step and carries the chat's creation time
+        return [_fingerprint(v) for v in value if not isinstance(v, SystemMessage)]
+    return value
+
+
+def time_bucket(current_time: str, granularity_seconds: int) -> int:
+    return int(datetime.fromisoformat(current_time).timestamp()) // granularity_seconds
+
+
+def step_key(step: str, model_name: str, prompts: list[str], state: dict, inputs: list[str], time_sensitive: bool) -> str:
+    payload = {
+        "step": step,
+        "model": model_name,
+        # Resolved per call, a refreshed prompt version invalidates the entries of the old one
+        "prompts": [dumpd(PromptRegistry.get(name)) for name in prompts],
+        "inputs": {name: _fingerprint(state.get(name)) for name in inputs},
+    }
+    if time_sensitive:
+        payload["time"] = time_bucket(state["current_time"], settings.LLM_CACHE_TIME_GRANULARITY_SECONDS)
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def cached_step(step: str, inputs: list[str], outputs: list[str], prompts: list[str] = (),
+                llm_name: str = "openai", time_sensitive: bool = False,
+                cache_if: Optional[Callable[[dict], bool]] = None):
+    """
+    Memoize a graph node on the state fields it reads. On a hit the cached outputs are written to the
+    state and the node (and its LLM call) is skipped. Only meant for deterministic (temperature 0) steps.
+    cache_if decides from the node's output state whether it is stored, e.g. not after a failed call.
+    """
+    def decorator(node):
+        @functools.wraps(node)
+        async def wrapper(state):
+            cache = get_step_cache()
+            try:
+                key = step_key(step, LLMRegistry.get(llm_name).model_name, list(prompts), state, inputs,
+                               time_sensitive)
+                cached = await asyncio.to_thread(cache.get, key)
+            except Exception as e:
+                logging.warning(f"[cached_step] Cache lookup for {step} failed: {e}")
+                return await node(state)
+
+            metrics.observe_cache("llm_step", cached is not None)
+            if cached is not None:
+                state.update(cached)
+                return state
+
+            state = await node(state)
+            if cache_if is not None and not cache_if(state):
+                return state
+            try:
+                await asyncio.to_thread(cache.put, key, step, {name: state.get(name) for name in outputs})
+            except Exception as e:
+                logging.warning(f"[cached_step] Storing {step} failed: {e}")
+            return state
+
+        return wrapper
+
+    return decorator
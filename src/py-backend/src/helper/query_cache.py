@@ -0,0 +1,122 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import settings
+
+# Whitespace next to these never changes how a statement is tokenized
+PUNCTUATION = set(",()=<>;")
+# In a normalized query: values that differ between two runs on the same data ('now', CURRENT_DATE, random()),
+# including the date functions called without a time value, which default to 'now'
+VOLATILE = ("'now'", "current_", "random(", "date()", "time()", "julianday()", "unixepoch()")
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Canonical form of a query for cache keys: comments removed, whitespace collapsed (and dropped around
+    punctuation), trailing semicolons dropped and everything outside literals and quoted identifiers lower-cased.
+    """
+    out = []
+    i, n = 0, len(sql)
+    pending_space = False
+
+    while i < n:
+        c = sql[i]
+        if c in "'\"`[":
+            closing = "]" if c == "[" else c
+            end = i + 1
+            while end < n:
+                if sql[end] == closing:
+                    # Doubled quote is an escaped quote inside the literal
+                    if closing != "]" and end + 1 < n and sql[end + 1] == closing:
+                        end += 2
+                        continue
+                    break
+                end += 1
+            if pending_space and out and out[-1][-1] not in PUNCTUATION:
+                out.append(" ")
+            pending_space = False
+            out.append(sql[i:end + 1])
+            i = end + 1
+        elif sql.startswith("--", i):
+            end = sql.find("\n", i)
+            i = n if end == -1 else end
+            pending_space = True
+        elif sql.startswith("/*", i):
+            end = sql.find("*/", i + 2)
+            i = n if end == -1 else end + 2
+            pending_space = True
+        elif c.isspace():
+            pending_space = True
+            i += 1
+        else:
+            if pending_space and out and c not in PUNCTUATION and out[-1][-1] not in PUNCTUATION:
+                out.append(" ")
+            pending_space = False
+            out.append(c.lower())
+            i += 1
+
+    return "".join(out).rstrip("; ")
+
+
+def is_volatile(sql: str) -> bool:
+    """Whether the result depends on when the query runs, not only on the data; such results are not cached."""
+    normalized = normalize_sql(sql).lower()
+    return any(token in normalized for token in VOLATILE)
+
+
+class QueryResultCache:
+    """LRU cache of formatted query results, bounded by the approximate size of the cached text."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple, tuple[object, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(sql: str, data_version, *extra) -> tuple:
+        return (normalize_sql(sql), data_version) + extra
+
+    def get(self, key: tuple) -> Optional[object]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: tuple, value: object, size: int):
+        if size > self.max_size:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size": self.size,
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+result_cache = QueryResultCache(settings.QUERY_CACHE_MAX_SIZE)
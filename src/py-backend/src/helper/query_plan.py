@@ -0,0 +1,263 @@
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import NamedTuple, Optional
+
+import settings
+import sql_executor
+from database import connect_readonly, get_data_version
+from helper.result_utils import ColumnarResult
+
+# Strategies preflight_query can pick for a generated query, each one routes the graph differently
+FETCH = "fetch"            # rows passed on as fetched; generate_answer uses one prompt or chunk summaries, by tokens
+AGGREGATE = "aggregate"    # fetched in full and aggregated locally before it reaches the model
+TOO_BROAD = "too_broad"    # sent back to write_query with a hint
+
+# FROM/JOIN clauses, to map the aliases EXPLAIN QUERY PLAN reports back to tables
+TABLE_REFERENCE = re.compile(
+    r'\b(?:from|join)\s+"?([\w.]+)"?(?:\s+(?:as\s+)?"?(\w+)"?)?',
+    re.IGNORECASE,
+)
+NOT_ALIASES = {"where", "join", "on", "group", "order", "limit", "left", "right", "inner", "outer", "cross",
+               "natural", "using", "union", "except", "intersect", "having", "window"}
+PLAN_SCAN = re.compile(r"^SCAN (\S+)(.*)$")
+TIMESTAMP = re.compile(r"^\d{4}-\d{2}-\d{2}")
+# Numeric columns aggregate_result leaves out of the sums, besides names ending in Id/_id or containing epoch
+IDENTIFIER_COLUMNS = {"id", "pid", "rowid"}
+# 2000-01-01 to 2100-01-01 in seconds since the epoch
+EPOCH_SECONDS = (946684800, 4102444800)
+
+
+class Preflight(NamedTuple):
+    plan: list[str]
+    # Real tables the plan reads in full: (table, rows in it)
+    full_scans: list[tuple[str, int]]
+    # Rows the query returns, counted up to SQL_MAX_ROWS; None if counting ran out of time
+    estimated_rows: Optional[int]
+    # The count stopped at its limit, the query returns at least estimated_rows rows
+    at_least: bool
+    error: Optional[str]
+
+
+class Aggregation(NamedTuple):
+    result: ColumnarResult
+    note: str
+
+
+def strip_statement(sql: str) -> str:
+    return sql.strip().rstrip(";").strip()
+
+
+_table_rows: dict[tuple, int] = {}
+_table_rows_lock = threading.Lock()
+
+
+def table_rows(conn: sqlite3.Connection, table: str) -> int:
+    """Rows in a table, from the ANALYZE statistics if there are any, counted (and cached per data version) if not."""
+    key = (get_data_version(), table)
+    with _table_rows_lock:
+        if key in _table_rows:
+            return _table_rows[key]
+
+    rows = None
+    try:
+        stat = conn.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = ? LIMIT 1", (table,)).fetchone()
+        if stat:
+            rows = int(stat[0].split()[0])
+    except sqlite3.OperationalError:
+        pass  # not analyzed
+    if rows is None:
+        rows = conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+
+    with _table_rows_lock:
+        _table_rows[key] = rows
+    return rows
+
+
+def _full_scans(conn: sqlite3.Connection, sql: str, plan: list[str]) -> list[tuple[str, int]]:
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    aliases = {}
+    for table, alias in TABLE_REFERENCE.findall(sql):
+        table = table.split(".")[-1]
+        aliases[table] = table
+        if alias and alias.lower() not in NOT_ALIASES:
+            aliases[alias] = table
+
+    scans = []
+    for detail in plan:
+        match = PLAN_SCAN.match(detail)
+        if not match:
+            continue
+        table = aliases.get(match.group(1), match.group(1))
+        if table in tables and table not in [scanned for scanned, _ in scans]:
+            scans.append((table, table_rows(conn, table)))
+    return scans
+
+
+def preflight(sql: str) -> Preflight:
+    """EXPLAIN QUERY PLAN of sql and a COUNT(*) of its rows that stops at SQL_MAX_ROWS or the preflight timeout."""
+    sql = strip_statement(sql)
+    conn = connect_readonly()
+    try:
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+        full_scans = _full_scans(conn, sql, plan)
+    except sqlite3.Error as e:
+        # execute_query reports the error as before
+        return Preflight([], [], None, False, str(e))
+    finally:
+        conn.close()
+
+    limit = settings.SQL_MAX_ROWS + 1
+    count = sql_executor.QueryExecution(
+        f"SELECT COUNT(*) FROM (SELECT 1 FROM ({sql}) LIMIT {limit})",
+        settings.PREFLIGHT_TIMEOUT_SECONDS, 1, settings.SQL_MAX_BYTES,
+    )
+    try:
+        rows = next(count.run().result.rows())[0]
+    except sql_executor.QueryTimeout:
+        return Preflight(plan, full_scans, None, False, None)
+    except sqlite3.Error as e:
+        return Preflight(plan, full_scans, None, False, str(e))
+    return Preflight(plan, full_scans, min(rows, settings.SQL_MAX_ROWS), rows >= limit, None)
+
+
+def choose_strategy(check: Preflight, retries: int) -> str:
+    """
+    Route by the number of rows: fetched as they are, or aggregated locally up to SQL_MAX_ROWS. A query with
+    more rows than that is too broad and goes back to the model, PREFLIGHT_MAX_RETRIES times at most; then it
+    is aggregated from the rows the executor's budget lets through. A count that ran out of time says the query
+    is slow, not that it is large: it is fetched, and the executor's own timeout and row budget apply.
+    """
+    rows = check.estimated_rows
+    if check.error or rows is None:
+        return FETCH
+    if check.at_least:
+        return TOO_BROAD if retries < settings.PREFLIGHT_MAX_RETRIES else AGGREGATE
+    if rows <= settings.PREFLIGHT_FETCH_MAX_ROWS:
+        return FETCH
+    return AGGREGATE
+
+
+def summarize(check: Preflight) -> str:
+    """One line for the approval payload and the too-broad hint."""
+    if check.error:
+        return f"Query could not be planned: {check.error}"
+    if check.estimated_rows is None:
+        parts = [f"row count unknown (counting took over {settings.PREFLIGHT_TIMEOUT_SECONDS:g}s)"]
+    else:
+        parts = [f"{'at least ' if check.at_least else ''}{check.estimated_rows} rows"]
+    large = [f"{table} ({rows} rows)" for table, rows in check.full_scans
+             if rows >= settings.PREFLIGHT_LARGE_TABLE_ROWS]
+    if large:
+        parts.append("full scan of " + ", ".join(large))
+    elif check.full_scans:
+        parts.append("full scan of " + ", ".join(table for table, _ in check.full_scans))
+    return "; ".join(parts)
+
+
+def too_broad_hint(sql: str, summary: str) -> str:
+    return (
+        f"The previous query was too broad ({summary}):\n{strip_statement(sql)}\n"
+        "Write a query that answers the question with fewer rows: aggregate (GROUP BY, SUM, COUNT) instead of "
+        "listing raw rows, and filter to the time range the question is about."
+    )
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_identifier(name: str) -> bool:
+    """id, processId, session_id, pid, tsEpoch: numbers that mean nothing summed or averaged."""
+    lower = name.lower()
+    return (lower in IDENTIFIER_COLUMNS or name.endswith(("Id", "ID")) or lower.endswith("_id")
+            or "epoch" in lower)
+
+
+def _looks_like_epoch(values: list) -> bool:
+    """Integers that are all seconds or milliseconds since the epoch between 2000 and 2100."""
+    if not all(isinstance(value, int) for value in values):
+        return False
+    low, high = min(values), max(values)
+    return (EPOCH_SECONDS[0] <= low and high < EPOCH_SECONDS[1]) or (
+        EPOCH_SECONDS[0] * 1000 <= low and high < EPOCH_SECONDS[1] * 1000)
+
+
+def aggregate_result(result: ColumnarResult, max_groups: int) -> Optional[Aggregation]:
+    """
+    Condense a large result locally: numeric columns become per-group sums and averages, grouped by the text
+    columns with few distinct values and then by the day of the first timestamp column, as long as the groups
+    stay within max_groups. Ids, epoch numbers, further timestamps and text with many distinct values (titles)
+    are dropped. None if there is nothing to group or sum.
+    """
+    if not len(result):
+        return None
+
+    measures, categories, days, dropped = [], [], [], []
+    for name, values in zip(result.columns, result.values):
+        present = [value for value in values if value is not None]
+        if not present:
+            dropped.append(name)
+        elif all(_is_number(value) for value in present):
+            if _is_identifier(name) or _looks_like_epoch(present):
+                dropped.append(name)
+            else:
+                measures.append(name)
+        elif all(isinstance(value, str) and TIMESTAMP.match(value) for value in present[:100]):
+            # Further timestamps (createdAt next to ts) are mostly the same day again
+            if days:
+                dropped.append(name)
+            else:
+                key = [value[:10] if isinstance(value, str) else None for value in values]
+                days.append((f"day({name})", key, len(set(key))))
+        else:
+            distinct = len(set(values))
+            if distinct <= max_groups:
+                categories.append((name, list(values), distinct))
+            else:
+                dropped.append(name)
+
+    # Categories with the fewest distinct values first, then the day, as long as the groups stay within
+    # max_groups. Groups are counted, not multiplied: processPath next to processName adds none.
+    group_by, groups = [], [()] * len(result)
+    for key in sorted(categories, key=lambda k: k[2]) + days:
+        extended = [group + (value,) for group, value in zip(groups, key[1])]
+        if len(set(extended)) <= max_groups:
+            group_by.append(key)
+            groups = extended
+        else:
+            dropped.append(key[0])
+    if not group_by and not measures:
+        return None
+
+    columns = dict(zip(result.columns, result.values))
+    counts, sums, numbers = Counter(), {}, {}
+    for i, group in enumerate(groups):
+        counts[group] += 1
+        for name in measures:
+            value = columns[name][i]
+            if value is not None:
+                sums[group, name] = sums.get((group, name), 0) + value
+                numbers[group, name] = numbers.get((group, name), 0) + 1
+
+    rows = []
+    for group in sorted(counts, key=lambda g: tuple((v is None, str(v)) for v in g)):
+        row = list(group) + [counts[group]]
+        for name in measures:
+            total, n = sums.get((group, name)), numbers.get((group, name), 0)
+            row += [round(total, 2) if total is not None else None, round(total / n, 2) if n else None]
+        rows.append(tuple(row))
+
+    header = [name for name, _, _ in group_by] + ["rows"]
+    for name in measures:
+        header += [f"sum_{name}", f"avg_{name}"]
+
+    note = f"Aggregated locally from {len(result)} rows"
+    if group_by:
+        note += f", grouped by {', '.join(name for name, _, _ in group_by)}"
+    if dropped:
+        note += f"; columns left out: {', '.join(dropped)}"
+    aggregated = ColumnarResult(header)
+    aggregated.extend(rows)
+    return Aggregation(aggregated, note)
@@ -0,0 +1,134 @@
+import os
+import sqlite3
+from pathlib import Path
+from typing import Optional
+
+from database import ANALYTICS_DB_PATH
+from helper.sync_state import get_watermark, set_watermark
+
+# Larger pages suit the long range scans of analytics queries; only takes effect when the file is created
+REPLICA_PAGE_SIZE = 8192
+
+# Replicated tables: (time columns, column rows are synced incrementally by). Tables without a sync
+# column are small and copied in full on every sync. The tables keep exactly the tracker's columns, as
+# SELECT * shows them.
+REPLICA_TABLES = {
+    'window_activity': (['ts'], 'ts'),
+    'user_input': (['tsStart', 'tsEnd'], 'tsStart'),
+    'usage_data': (['created_at'], 'created_at'),
+    'session': (['startedAt', 'endedAt'], None),
+    'experience_sampling_responses': (['promptedAt'], None),
+}
+
+REPLICA_INDEXES = {
+    'window_activity': [
+        'CREATE INDEX IF NOT EXISTS idx_window_activity_ts ON window_activity(ts)',
+        'CREATE INDEX IF NOT EXISTS idx_window_activity_activity_ts ON window_activity(activity, ts)',
+        'CREATE INDEX IF NOT EXISTS idx_window_activity_process_ts ON window_activity(processName, ts)',
+    ],
+    'user_input': [
+        'CREATE INDEX IF NOT EXISTS idx_user_input_ts_start ON user_input(tsStart)',
+    ],
+    'usage_data': [
+        'CREATE INDEX IF NOT EXISTS idx_usage_data_type_created_at ON usage_data(type, created_at)',
+    ],
+    'session': [
+        'CREATE INDEX IF NOT EXISTS idx_session_started_at ON session(startedAt)',
+    ],
+    'experience_sampling_responses': [
+        'CREATE INDEX IF NOT EXISTS idx_esr_prompted_at ON experience_sampling_responses(promptedAt)',
+    ],
+}
+
+
+def _columns(cur: sqlite3.Cursor, schema: str, table: str) -> list[tuple]:
+    """(name, type, pk) of every column of schema.table, empty if the table does not exist."""
+    cur.execute(f'PRAGMA {schema}.table_info("{table}")')
+    return [(row[1], row[2], row[5]) for row in cur.fetchall()]
+
+
+def _create_table(cur: sqlite3.Cursor, table: str, source_columns: list[tuple]):
+    primary_key = [name for name, _, pk in sorted(source_columns, key=lambda c: c[2]) if pk]
+    definitions = [f'"{name}" {col_type}' for name, col_type, _ in source_columns]
+    if primary_key:
+        quoted = ", ".join(f'"{name}"' for name in primary_key)
+        definitions.append(f'PRIMARY KEY ({quoted})')
+    cur.execute(f'DROP TABLE IF EXISTS main."{table}"')
+    cur.execute(f'CREATE TABLE main."{table}" ({", ".join(definitions)})')
+
+
+def _sync_table(cur: sqlite3.Cursor, table: str, incremental: bool) -> bool:
+    """Copy new and changed rows of one table from src. Returns whether the table was copied in full."""
+    time_columns, sync_column = REPLICA_TABLES[table]
+    source_columns = _columns(cur, 'src', table)
+    if not source_columns:
+        return False  # not in this tracker version
+
+    names = [name for name, _, _ in source_columns]
+
+    # A column added to the tracker table (e.g. durationInSeconds) means a fresh copy; so do the epoch
+    # columns earlier replicas added
+    if [name for name, _, _ in _columns(cur, 'main', table)] != names:
+        _create_table(cur, table, source_columns)
+        incremental = False
+
+    watermark_key = f'replica_{table}'
+    since: Optional[str] = None
+    if incremental and sync_column in names:
+        since = get_watermark(cur, watermark_key)
+
+    select = target = ", ".join(f'"{name}"' for name in names)
+    if since is None:
+        cur.execute(f'DELETE FROM main."{table}"')
+        cur.execute(f'INSERT INTO main."{table}" ({target}) SELECT {select} FROM src."{table}"')
+    else:
+        # Rows at the watermark are copied again, they may have been updated since (durations)
+        cur.execute(f'DELETE FROM main."{table}" WHERE "{sync_column}" >= ?', (since,))
+        cur.execute(f'''
+            INSERT OR REPLACE INTO main."{table}" ({target})
+            SELECT {select} FROM src."{table}" WHERE "{sync_column}" >= ?
+        ''', (since,))
+
+    for statement in REPLICA_INDEXES.get(table, []):
+        cur.execute(statement)
+    # Expression index of earlier replicas, no generated query uses its expression
+    cur.execute(f'DROP INDEX IF EXISTS main."idx_{table}_{time_columns[0]}_epoch"')
+
+    if sync_column in names:
+        cur.execute(f'SELECT MAX("{sync_column}") FROM src."{table}"')
+        set_watermark(cur, watermark_key, cur.fetchone()[0])
+    return since is None
+
+
+def _sync(replica_path: Path, db_path, incremental: bool):
+    conn = sqlite3.connect(str(replica_path), check_same_thread=False)
+    cur = conn.cursor()
+    cur.execute(f'PRAGMA page_size = {REPLICA_PAGE_SIZE}')
+    cur.execute('PRAGMA journal_mode=WAL')
+    cur.execute('ATTACH DATABASE ? AS src', (str(db_path),))
+
+    copied_in_full = [_sync_table(cur, table, incremental) for table in REPLICA_TABLES]
+    conn.commit()
+
+    # Full statistics after a rebuild; otherwise optimize only re-analyzes tables that changed a lot
+    cur.execute('ANALYZE' if any(copied_in_full) else 'PRAGMA optimize')
+    conn.commit()
+    cur.execute('DETACH DATABASE src')
+    conn.close()
+
+
+def sync_replica(db_path, replica_path: Path = ANALYTICS_DB_PATH, incremental=True):
+    """
+    Bring the analytics replica up to date with the tracker DB at db_path. Run after the tracker's derived
+    columns and tables are updated. The first build goes to a temporary file that is moved into place
+    when complete, so database.get_db() only switches to the replica once it is usable.
+    """
+    if replica_path.exists():
+        _sync(replica_path, db_path, incremental)
+        return
+
+    tmp_path = replica_path.with_name(replica_path.name + '.tmp')
+    tmp_path.unlink(missing_ok=True)
+    _sync(tmp_path, db_path, incremental=False)
+    # Closing the last connection checkpointed and removed the WAL, the build is a single file now
+    os.replace(tmp_path, replica_path)
@@ -1,37 +1,171 @@
-import math
+from typing import Callable, Iterator, NamedTuple, Optional, Sequence
+
+# Rough average for English text and numbers with the OpenAI tokenizers, good enough for packing chunks
+CHARS_PER_TOKEN = 4
+
+NO_RESULTS = "No results found"
+
+
+class ColumnarResult:
+    """
+    Query result stored column-wise: the column names once and one list of values per column,
+    instead of a dict per row repeating every name.
+    """
+
+    def __init__(self, columns: Sequence[str], values: Optional[list[list]] = None):
+        self.columns = list(columns)
+        self.values = values if values is not None else [[] for _ in self.columns]
+
+    def extend(self, rows: Sequence[tuple]):
+        """Append row tuples (as returned by cursor.fetchmany), one column at a time."""
+        if rows:
+            for values, column in zip(self.values, zip(*rows)):
+                values.extend(column)
+
+    def __len__(self) -> int:
+        return len(self.values[0]) if self.values else 0
+
+    def rows(self) -> Iterator[tuple]:
+        return zip(*self.values)
+
+    def to_dicts(self) -> list[dict]:
+        return [dict(zip(self.columns, row)) for row in self.rows()]
 
 
 def escape_md_cell(value: str) -> str:
     return f"`{value.replace('`', '')}`" if "|" in value or "\n" in value else value
 
 
-def format_result_as_markdown(result: list[dict]) -> str:
-    if not result:
-        return "No results found"
+def escape_csv_cell(value: str) -> str:
+    if "," in value or '"' in value or "\n" in value or "\r" in value:
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def escape_tsv_cell(value: str) -> str:
+    if "\t" in value or "\n" in value or "\r" in value:
+        return value.replace("\r\n", " ").replace("\t", " ").replace("\n", " ").replace("\r", " ")
+    return value
+
+
+def compact_value(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        # Durations and averages rarely need more than two decimals, and the digits cost tokens
+        return str(round(value, 2))
+    return escape_md_cell(str(value))
+
+
+class ResultFormat(NamedTuple):
+    """How a result is laid out as text. Cells are converted a column at a time, then joined per row."""
+    header: Callable[[list[str]], str]
+    cell: Callable[[object], str]
+    separator: str
+    line: Callable[[int, str], str]
+    # Estimated tokens a row costs on top of its cells (delimiters, row numbers)
+    row_overhead: int
 
-    headers = list(result[0].keys())
-    headers = ["#"] + headers  # Add row number header
 
-    lines = ["| " + " | ".join(headers) + " |", "| " + " | ".join(["---"] * len(headers)) + " |"]
+def markdown_header(columns: list[str]) -> str:
+    headers = ["#"] + columns  # Add row number header
+    return "| " + " | ".join(headers) + " |\n" + "| " + " | ".join(["---"] * len(headers)) + " |"
 
-    for idx, row in enumerate(result, start=1):
-        row_values = [str(idx)] + [escape_md_cell(str(value)) for value in row.values()]
-        lines.append("| " + " | ".join(row_values) + " |")
 
+FORMATS = {
+    "markdown": ResultFormat(
+        header=markdown_header,
+        cell=lambda value: escape_md_cell(str(value)),
+        separator=" | ",
+        line=lambda idx, cells: f"| {idx} | {cells} |",
+        # "| <row number> | " prefix and " |" suffix add about a dozen characters
+        row_overhead=3,
+    ),
+    "tsv": ResultFormat(
+        header=lambda columns: "\t".join(columns),
+        cell=lambda value: escape_tsv_cell(str(value)),
+        separator="\t",
+        line=lambda idx, cells: cells,
+        row_overhead=1,
+    ),
+    "csv": ResultFormat(
+        header=lambda columns: ",".join(escape_csv_cell(column) for column in columns),
+        cell=lambda value: escape_csv_cell(str(value)),
+        separator=",",
+        line=lambda idx, cells: cells,
+        row_overhead=1,
+    ),
+    # Header once, bare "|" between cells, no row numbers, NULLs empty and floats rounded
+    "compact": ResultFormat(
+        header=lambda columns: "|".join(columns),
+        cell=compact_value,
+        separator="|",
+        line=lambda idx, cells: cells,
+        row_overhead=1,
+    ),
+}
+
+
+def get_format(name: str) -> ResultFormat:
+    try:
+        return FORMATS[name]
+    except KeyError:
+        raise ValueError(f"Unknown result format: {name}") from None
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def row_tokens(cells: str, overhead: int = 3) -> int:
+    return estimate_tokens(cells) + overhead
+
+
+def format_rows(result: ColumnarResult, fmt: ResultFormat) -> list[str]:
+    """The joined cells of every row: each column is converted with one map() call, rows are joined via zip."""
+    columns = [list(map(fmt.cell, values)) for values in result.values]
+    return [fmt.separator.join(cells) for cells in zip(*columns)]
+
+
+def format_result(result: ColumnarResult, fmt: str = "markdown") -> str:
+    if not len(result):
+        return NO_RESULTS
+
+    layout = get_format(fmt)
+    lines = [layout.header(result.columns)]
+    lines.extend(layout.line(idx, cells) for idx, cells in enumerate(format_rows(result, layout), start=1))
     return "\n".join(lines)
 
 
-def split_result(data: list[dict], max_chunk_size: int = 5000) -> list[list[dict]]:
+def format_result_as_markdown(result: ColumnarResult) -> str:
+    return format_result(result, "markdown")
+
+
+def iter_chunks(result: ColumnarResult, token_budget: int, fmt: str = "markdown") -> Iterator[str]:
     """
-    Splits data into evenly sized chunks where each chunk has <= max_entries.
+    Pack rows into chunks of at most token_budget (estimated) tokens each, every chunk with its own header.
+    Every row is formatted once; a single row larger than the budget gets a chunk of its own.
     """
-    total = len(data)
-    if total <= max_chunk_size:
-        return [data]
+    if not len(result):
+        yield NO_RESULTS
+        return
+
+    layout = get_format(fmt)
+    header = layout.header(result.columns)
+    header_tokens = estimate_tokens(header)
+    lines, tokens = [header], header_tokens
+
+    for cells in format_rows(result, layout):
+        cost = row_tokens(cells, layout.row_overhead)
+        if len(lines) > 1 and tokens + cost > token_budget:
+            yield "\n".join(lines)
+            lines, tokens = [header], header_tokens
+        lines.append(layout.line(len(lines), cells))
+        tokens += cost
+
+    yield "\n".join(lines)
+
 
-    for num_chunks in range(2, total + 1):
-        chunk_size = math.ceil(total / num_chunks)
-        if chunk_size <= max_chunk_size:
-            break
+def chunk_result(result: ColumnarResult, token_budget: int, fmt: str = "markdown") -> list[str]:
+    return list(iter_chunks(result, token_budget, fmt))
 
-    return [data[i * chunk_size:(i + 1) * chunk_size] for i in range(num_chunks)]
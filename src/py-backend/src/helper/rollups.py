@@ -0,0 +1,183 @@
+import sqlite3
+from pathlib import Path
+from typing import Optional
+
+from database import ROLLUPS_DB_PATH, derived_data_current
+from helper.sync_state import get_watermark, set_watermark
+
+# Day (YYYY-MM-DD) from which the next refresh recomputes; everything before it is final
+ROLLUP_WATERMARK = 'rollups_since'
+# Latest window_activity.ts / user_input.tsStart the rollups include, told to the model with their table info
+ROLLUP_COVERAGE = 'rollups_until'
+
+ROLLUP_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS activity_daily (
+        day TEXT,
+        activity TEXT,
+        processName TEXT,
+        durationInSeconds INTEGER,
+        windowCount INTEGER,
+        PRIMARY KEY (day, activity, processName)
+    );
+    CREATE TABLE IF NOT EXISTS activity_hourly (
+        hour TEXT,
+        activity TEXT,
+        processName TEXT,
+        durationInSeconds INTEGER,
+        windowCount INTEGER,
+        PRIMARY KEY (hour, activity, processName)
+    );
+    CREATE TABLE IF NOT EXISTS input_hourly (
+        hour TEXT PRIMARY KEY,
+        keysTotal INTEGER,
+        clickTotal INTEGER,
+        movedDistance REAL,
+        scrollDelta REAL,
+        intervalCount INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS input_session (
+        sessionId TEXT PRIMARY KEY,
+        startedAt TEXT,
+        endedAt TEXT,
+        durationInSeconds INTEGER,
+        keysTotal INTEGER,
+        clickTotal INTEGER,
+        movedDistance REAL,
+        scrollDelta REAL,
+        intervalCount INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS idx_input_session_started_at ON input_session(startedAt);
+'''
+
+# Statements per source table, run with :since, against the tracker DB attached as "src".
+# Windows count toward the day/hour they started in.
+ROLLUP_REFRESH_SQL = {
+    'window_activity': [
+        'DELETE FROM activity_daily WHERE day >= :since',
+        '''
+        INSERT INTO activity_daily (day, activity, processName, durationInSeconds, windowCount)
+        SELECT date(ts), activity, processName, SUM(durationInSeconds), COUNT(*)
+        FROM src.window_activity
+        WHERE ts >= :since
+        GROUP BY 1, 2, 3
+        ''',
+        'DELETE FROM activity_hourly WHERE hour >= :since',
+        '''
+        INSERT INTO activity_hourly (hour, activity, processName, durationInSeconds, windowCount)
+        SELECT strftime('%Y-%m-%d %H:00', ts), activity, processName, SUM(durationInSeconds), COUNT(*)
+        FROM src.window_activity
+        WHERE ts >= :since
+        GROUP BY 1, 2, 3
+        ''',
+    ],
+    'user_input': [
+        'DELETE FROM input_hourly WHERE hour >= :since',
+        '''
+        INSERT INTO input_hourly (hour, keysTotal, clickTotal, movedDistance, scrollDelta, intervalCount)
+        SELECT strftime('%Y-%m-%d %H:00', tsStart),
+               SUM(keysTotal), SUM(clickTotal), SUM(movedDistance), SUM(scrollDelta), COUNT(*)
+        FROM src.user_input
+        WHERE tsStart >= :since
+        GROUP BY 1
+        ''',
+    ],
+    'session': [
+        'DELETE FROM input_session WHERE endedAt >= :since',
+        '''
+        INSERT OR REPLACE INTO input_session (
+            sessionId, startedAt, endedAt, durationInSeconds,
+            keysTotal, clickTotal, movedDistance, scrollDelta, intervalCount
+        )
+        SELECT s.id, s.startedAt, s.endedAt, s.durationInSeconds,
+               SUM(ui.keysTotal), SUM(ui.clickTotal), SUM(ui.movedDistance), SUM(ui.scrollDelta), COUNT(ui.rowid)
+        FROM src.session s
+        LEFT JOIN src.user_input ui ON ui.tsStart >= s.startedAt AND ui.tsStart < s.endedAt
+        WHERE s.endedAt >= :since
+        GROUP BY s.id
+        ''',
+    ],
+}
+
+# Appended to the table info of write_query, per source table the question was mapped to
+ROLLUP_TABLE_INFO = {
+    'window_activity': '''Precomputed rollups of window_activity (PREFER THESE over aggregating window_activity when \
+the question only needs totals per day or hour; each window counts toward the day/hour it started in):
+CREATE TABLE activity_daily (day TEXT /* YYYY-MM-DD */, activity TEXT, processName TEXT, \
+durationInSeconds INTEGER /* SUM over windows */, windowCount INTEGER)
+CREATE TABLE activity_hourly (hour TEXT /* YYYY-MM-DD HH:00 */, activity TEXT, processName TEXT, \
+durationInSeconds INTEGER, windowCount INTEGER)''',
+    'user_input': '''Precomputed rollup of user_input (PREFER THIS over aggregating user_input per hour or day):
+CREATE TABLE input_hourly (hour TEXT /* YYYY-MM-DD HH:00 */, keysTotal INTEGER, clickTotal INTEGER, \
+movedDistance REAL, scrollDelta REAL, intervalCount INTEGER /* user_input rows */)''',
+    'session': '''Precomputed user_input totals per session (PREFER THIS over joining user_input with session):
+CREATE TABLE input_session (sessionId TEXT /* session.id */, startedAt TEXT, endedAt TEXT, \
+durationInSeconds INTEGER, keysTotal INTEGER, clickTotal INTEGER, movedDistance REAL, scrollDelta REAL, \
+intervalCount INTEGER)''',
+}
+
+
+def rollups_available() -> bool:
+    """The rollups exist and the last refresh (helper.data_refresh) succeeded, so they don't lag the tracker DB."""
+    return ROLLUPS_DB_PATH.exists() and derived_data_current()
+
+
+def rollups_coverage_end() -> Optional[str]:
+    conn = sqlite3.connect(f"file:{ROLLUPS_DB_PATH}?mode=ro", uri=True)
+    try:
+        return get_watermark(conn.cursor(), ROLLUP_COVERAGE)
+    except sqlite3.OperationalError:
+        return None  # read-only, pq_sync_state not created yet
+    finally:
+        conn.close()
+
+
+def get_rollup_table_info(tables: list[str]) -> str:
+    if not rollups_available():
+        return ""
+    info = [ROLLUP_TABLE_INFO[table] for table in tables if table in ROLLUP_TABLE_INFO]
+    if not info:
+        return ""
+    until = rollups_coverage_end()
+    if until:
+        info.insert(0, f"The precomputed rollups include data up to {until}; for anything later query the tables "
+                       "they are built from.")
+    return "\n\n".join(info)
+
+
+def refresh_rollups(db_path, rollups_path: Path = ROLLUPS_DB_PATH, incremental=True):
+    """
+    Rebuild the rollup tables from the tracker DB at db_path. Run after add_window_activity_durations and
+    update_sessions_from_usage_data. In incremental mode only days from the watermark onward are recomputed.
+    """
+    rollups_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(rollups_path), check_same_thread=False)
+    cur = conn.cursor()
+    cur.execute('PRAGMA journal_mode=WAL')
+    cur.executescript(ROLLUP_SCHEMA)
+    cur.execute('ATTACH DATABASE ? AS src', (str(db_path),))
+
+    cur.execute("SELECT name FROM src.sqlite_master WHERE type = 'table'")
+    source_tables = {row[0] for row in cur.fetchall()}
+    if 'user_input' in source_tables:
+        cur.execute('CREATE INDEX IF NOT EXISTS src.idx_user_input_ts_start ON user_input(tsStart)')
+
+    since = (get_watermark(cur, ROLLUP_WATERMARK) if incremental else None) or ''
+    for table, statements in ROLLUP_REFRESH_SQL.items():
+        if table not in source_tables:
+            continue
+        for statement in statements:
+            cur.execute(statement, {"since": since})
+
+    # Rows of the last day may still change (durations, late input), so the next refresh starts there
+    latest = []
+    if 'window_activity' in source_tables:
+        latest.append(cur.execute('SELECT MAX(ts) FROM src.window_activity').fetchone()[0])
+    if 'user_input' in source_tables:
+        latest.append(cur.execute('SELECT MAX(tsStart) FROM src.user_input').fetchone()[0])
+    latest = [ts for ts in latest if ts]
+    set_watermark(cur, ROLLUP_WATERMARK, min(latest)[:10] if latest else None)
+    set_watermark(cur, ROLLUP_COVERAGE, max(latest) if latest else None)
+
+    conn.commit()
+    cur.execute('DETACH DATABASE src')
+    conn.close()
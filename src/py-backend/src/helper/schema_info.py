@@ -0,0 +1,144 @@
+import re
+import threading
+from typing import NamedTuple, Optional
+
+import settings
+from database import get_readonly_connection, query_db_path
+
+# PersonalQuery's own bookkeeping in the tracker DB and the replica (helper.sync_state), not user data
+INTERNAL_TABLE_PREFIX = 'pq_'
+
+# Columns every description of the table keeps, whatever the question (time filters, joins)
+KEEP_COLUMNS = {
+    'window_activity': {'ts', 'activity', 'durationInSeconds'},
+    'user_input': {'tsStart', 'tsEnd'},
+    'usage_data': {'created_at', 'type'},
+    'session': {'id', 'startedAt', 'endedAt', 'durationInSeconds'},
+    'experience_sampling_responses': {'promptedAt'},
+}
+
+# Words in a question that point at a column without sharing a word with its name
+COLUMN_KEYWORDS = {
+    'windowTitle': {'title', 'file', 'document', 'tab', 'page', 'project'},
+    'processName': {'app', 'application', 'program', 'process', 'tool'},
+    'url': {'website', 'site', 'browser', 'link', 'domain', 'page'},
+    'keysTotal': {'typing', 'typed', 'keystroke', 'keyboard', 'key'},
+    'clickTotal': {'click', 'clicking', 'mouse'},
+    'movedDistance': {'mouse', 'moved', 'movement'},
+    'scrollDelta': {'scroll', 'scrolling'},
+    'durationInSeconds': {'time', 'long', 'spent', 'hour', 'minute'},
+    'question': {'productive', 'productivity', 'rating', 'feel'},
+    'response': {'productive', 'productivity', 'rating', 'answer'},
+    'scale': {'productive', 'productivity', 'rating'},
+    'skipped': {'skip', 'skipped'},
+}
+
+
+# Too common in questions to say anything about columns ("in" of durationInSeconds, "total" of keysTotal)
+STOP_WORDS = {'the', 'and', 'for', 'from', 'with', 'what', 'when', 'how', 'many', 'much', 'did', 'was', 'total'}
+
+
+class TableSchema(NamedTuple):
+    name: str
+    columns: list[tuple[str, str]]
+    primary_key: set[str]
+    samples: list[tuple]
+
+
+def _words(text: str) -> set[str]:
+    """Lower-cased words of text or of a camelCase/snake_case name, with a plural "s" dropped."""
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", text)
+    return {word[:-1] if len(word) > 3 and word.endswith("s") else word
+            for word in re.findall(r"[a-z0-9]+", text.lower())
+            if len(word) > 2 and word not in STOP_WORDS}
+
+
+class SchemaInfoCache:
+    """
+    Table descriptions (columns and sample rows) of the queried DB, read once and reused until its
+    PRAGMA schema_version (or the file being queried) changes.
+    """
+
+    def __init__(self, sample_rows: int):
+        self.sample_rows = sample_rows
+        self._key = None
+        self._tables: dict[str, TableSchema] = {}
+        self._lock = threading.Lock()
+
+    def get(self) -> dict[str, TableSchema]:
+        conn = get_readonly_connection()
+        key = (query_db_path(), conn.execute("PRAGMA schema_version").fetchone()[0])
+        with self._lock:
+            if key != self._key:
+                names = [row[0] for row in conn.execute(
+                    "SELECT name FROM main.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+                ) if not row[0].startswith(INTERNAL_TABLE_PREFIX)]
+                self._tables = {name: self._read_table(conn, name) for name in names}
+                self._key = key
+            return self._tables
+
+    def _read_table(self, conn, name: str) -> TableSchema:
+        info = conn.execute(f'PRAGMA main.table_info("{name}")').fetchall()
+        samples = conn.execute(f'SELECT * FROM main."{name}" LIMIT {self.sample_rows}').fetchall()
+        return TableSchema(
+            name=name,
+            columns=[(row[1], row[2] or "") for row in info],
+            primary_key={row[1] for row in info if row[5]},
+            samples=samples,
+        )
+
+    def clear(self):
+        with self._lock:
+            self._key = None
+            self._tables = {}
+
+
+def relevant_columns(table: TableSchema, question_words: set[str]) -> Optional[list[str]]:
+    """
+    Columns of table that the question may need, or None to keep them all. Pruning only happens when the
+    question names at least one column; the table's key and time columns always stay.
+    """
+    matched = [
+        name for name, _ in table.columns
+        if _words(name) & question_words or COLUMN_KEYWORDS.get(name, set()) & question_words
+    ]
+    if not matched:
+        return None
+    keep = KEEP_COLUMNS.get(table.name, set()) | table.primary_key | set(matched)
+    return [name for name, _ in table.columns if name in keep]
+
+
+def render_table(table: TableSchema, columns: Optional[list[str]] = None) -> str:
+    """CREATE TABLE statement and sample rows, in the layout of SQLDatabase.get_table_info."""
+    shown = [i for i, (name, _) in enumerate(table.columns) if columns is None or name in columns]
+    definitions = [f"\t{table.columns[i][0]} {table.columns[i][1]}".rstrip() for i in shown]
+    if table.primary_key:
+        definitions.append(f"\tPRIMARY KEY ({', '.join(sorted(table.primary_key))})")
+    definitions = ",\n".join(definitions)
+    info = f"\nCREATE TABLE {table.name} (\n{definitions}\n)"
+
+    omitted = [name for i, (name, _) in enumerate(table.columns) if i not in shown]
+    if omitted:
+        info += f"\n-- further columns, not shown: {', '.join(omitted)}"
+
+    header = "\t".join(table.columns[i][0] for i in shown)
+    rows = "\n".join("\t".join(str(row[i])[:100] for i in shown) for row in table.samples)
+    info += f"\n\n/*\n{len(table.samples)} rows from {table.name} table:\n{header}\n{rows}\n*/"
+    return info
+
+
+def get_table_info(question: str = "", tables: Optional[list[str]] = None) -> str:
+    """Descriptions of the given (default: all) tables, pruned to the question's columns if enabled."""
+    schemas = schema_cache.get()
+    question_words = _words(question) if settings.SCHEMA_COLUMN_PRUNING and question else set()
+
+    parts = []
+    for name, table in schemas.items():
+        if tables is not None and name not in tables:
+            continue
+        columns = relevant_columns(table, question_words) if question_words else None
+        parts.append(render_table(table, columns))
+    return "\n\n".join(parts)
+
+
+schema_cache = SchemaInfoCache(settings.SCHEMA_SAMPLE_ROWS)
@@ -0,0 +1,31 @@
+import sqlite3
+from typing import Optional
+
+
+def ensure_sync_state(cur: sqlite3.Cursor):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS pq_sync_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+
+def get_watermark(cur: sqlite3.Cursor, key: str) -> Optional[str]:
+    """Return the last processed position stored under key, or None if nothing was processed yet."""
+    ensure_sync_state(cur)
+    cur.execute('SELECT value FROM pq_sync_state WHERE key = ?', (key,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def set_watermark(cur: sqlite3.Cursor, key: str, value: Optional[str]):
+    ensure_sync_state(cur)
+    if value is None:
+        cur.execute('DELETE FROM pq_sync_state WHERE key = ?', (key,))
+        return
+
+    cur.execute('''
+        INSERT INTO pq_sync_state (key, value) VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+    ''', (key, value))
@@ -13,3 +13,21 @@ def resolve_approval(chat_id: str, data: dict):
     if chat_id in approval_futures:
         approval_futures[chat_id].set_result(data)
         del approval_futures[chat_id]
+
+
+# on_update callbacks of the websocket that asked a question now waiting for approval, so that
+# /approval can stream the resumed answer to it
+update_listeners = {}
+
+
+def set_update_listener(chat_id: str, on_update):
+    update_listeners[chat_id] = on_update
+
+
+def pop_update_listener(chat_id: str):
+    return update_listeners.pop(chat_id, None)
+
+
+def remove_update_listeners(on_updates: set):
+    for chat_id in [cid for cid, listener in update_listeners.items() if listener in on_updates]:
+        del update_listeners[chat_id]
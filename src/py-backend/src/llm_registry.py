@@ -1,5 +1,9 @@
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
 from langchain_openai import ChatOpenAI
 
+import metrics
+
 
 class LLMRegistry:
     _llms: dict[str, ChatOpenAI] = {}
@@ -13,3 +17,26 @@ class LLMRegistry:
         if name not in cls._llms:
             raise ValueError(f"LLM '{name}' not registered.")
         return cls._llms[name]
+
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """Reports the token usage of every LLM call to metrics, attributed to the graph node making it."""
+    run_inline = True
+
+    def on_llm_end(self, response: LLMResult, **kwargs):
+        prompt_tokens = completion_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    prompt_tokens += usage.get("input_tokens", 0)
+                    completion_tokens += usage.get("output_tokens", 0)
+        if not (prompt_tokens or completion_tokens):
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            prompt_tokens = usage.get("prompt_tokens", 0)
+            completion_tokens = usage.get("completion_tokens", 0)
+        if prompt_tokens or completion_tokens:
+            metrics.observe_tokens(prompt_tokens, completion_tokens)
+
+
+token_usage_callback = TokenUsageCallback()
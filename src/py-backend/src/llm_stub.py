@@ -0,0 +1,392 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+import httpx
+
+import settings
+
+APPDATA_PATH = Path(os.getenv("APPDATA", Path.home()))
+LLM_STUB_DIR = APPDATA_PATH / "personal-query" / "llm_stub"
+DEFAULT_CASSETTE = LLM_STUB_DIR / "cassette.jsonl"
+
+# Base URL of the stub when it runs inside the backend process; requests never leave the httpx transport
+IN_PROCESS_BASE_URL = "http://llm-stub.local/v1"
+# The real base URL of a client, so that recording knows where to forward its requests
+UPSTREAM_HEADER = "X-PQ-Upstream"
+
+MODES = ("record", "replay", "synthetic")
+
+# Request fields that decide the response; stream and stream_options only change how it is delivered
+KEY_FIELDS = ("model", "messages", "tools", "tool_choice", "response_format", "temperature", "n",
+              "parallel_tool_calls")
+# Timestamps in prompts ("current_time") would otherwise make every recording single-use
+TIMESTAMP = re.compile(r"\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?([+-]\d{2}:?\d{2}|Z)?")
+
+# Share of the latency spent before the first streamed chunk, the rest is spread over the other chunks
+STREAM_FIRST_CHUNK_SHARE = 0.3
+STREAM_CHUNK_CHARACTERS = 16
+
+
+def request_key(body: dict) -> str:
+    relevant = {field: body[field] for field in KEY_FIELDS if field in body}
+    text = TIMESTAMP.sub("<timestamp>", json.dumps(relevant, sort_keys=True, ensure_ascii=False))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class Latency:
+    """
+    Synthetic response latency in seconds, from a spec: "none", "recorded" (as measured when recording),
+    "fixed:S", "uniform:A,B", "normal:MEAN,SD" or "lognormal:MEDIAN,SIGMA". Samples are seeded.
+    """
+
+    def __init__(self, spec: str = "none", seed: int = 0):
+        self.spec = spec
+        name, _, args = spec.partition(":")
+        self.kind = name.strip().lower()
+        self.args = [float(arg) for arg in args.split(",") if arg.strip()]
+        expected = {"none": 0, "recorded": 0, "fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+        if expected.get(self.kind) != len(self.args):
+            raise ValueError(f"Invalid latency spec '{spec}'")
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self, recorded: Optional[float] = None) -> float:
+        with self._lock:
+            if self.kind == "recorded":
+                return recorded or 0.0
+            if self.kind == "fixed":
+                return self.args[0]
+            if self.kind == "uniform":
+                return self._rng.uniform(*self.args)
+            if self.kind == "normal":
+                return max(0.0, self._rng.gauss(*self.args))
+            if self.kind == "lognormal":
+                median, sigma = self.args
+                return median * self._rng.lognormvariate(0.0, sigma)
+            return 0.0
+
+
+class Cassette:
+    """Recorded responses by request key, one JSON object per line. Later recordings of a key win."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._entries: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        if path.exists():
+            with path.open(encoding="utf-8") as file:
+                for line in file:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[entry["key"]] = entry
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[dict]:
+        return self._entries.get(key)
+
+    def add(self, key: str, request: dict, response: dict, latency: float):
+        entry = {"key": key, "model": request.get("model"), "request": request, "response": response,
+                 "latency": round(latency, 4)}
+        with self._lock:
+            self._entries[key] = entry
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as file:
+                file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def _instance(schema: dict, definitions: dict) -> Any:
+    """The simplest value that validates against a JSON schema (as generated from the pydantic/TypedDict schemas)."""
+    if "$ref" in schema:
+        return _instance(definitions[schema["$ref"].split("/")[-1]], definitions)
+    if "enum" in schema:
+        return schema["enum"][0]
+    if "const" in schema:
+        return schema["const"]
+    if "default" in schema:
+        return schema["default"]
+    for combinator in ("anyOf", "oneOf", "allOf"):
+        if combinator in schema:
+            options = [option for option in schema[combinator] if option.get("type") != "null"]
+            return _instance((options or schema[combinator])[0], definitions)
+
+    kind = schema.get("type", "object")
+    if isinstance(kind, list):
+        kind = next((k for k in kind if k != "null"), "null")
+    if kind == "object":
+        properties = schema.get("properties", {})
+        return {name: _instance(prop, definitions) for name, prop in properties.items()}
+    if kind == "array":
+        return [_instance(schema.get("items", {}), definitions)] if schema.get("minItems", 1) else []
+    return {"string": "stub", "integer": 0, "number": 0, "boolean": False, "null": None}.get(kind)
+
+
+def _estimate_tokens(value: Any) -> int:
+    return max(1, len(json.dumps(value, ensure_ascii=False)) // 4)
+
+
+def synthetic_completion(body: dict) -> dict:
+    """A schema-valid response without a model: a tool call if tools are offered, JSON for a json_schema format."""
+    message: dict = {"role": "assistant", "content": "This is a stub answer.", "refusal": None}
+    tools = body.get("tools") or []
+    response_format = body.get("response_format") or {}
+
+    if tools:
+        tool_choice = body.get("tool_choice")
+        chosen = tool_choice.get("function", {}).get("name") if isinstance(tool_choice, dict) else None
+        function = next((t["function"] for t in tools if t["function"]["name"] == chosen), tools[0]["function"])
+        parameters = function.get("parameters", {})
+        arguments = _instance(parameters, parameters.get("$defs", {}))
+        message["content"] = None
+        message["tool_calls"] = [{
+            "id": "call_" + request_key(body)[:24],
+            "type": "function",
+            "function": {"name": function["name"], "arguments": json.dumps(arguments)},
+        }]
+    elif response_format.get("type") == "json_schema":
+        schema = response_format["json_schema"].get("schema", {})
+        message["content"] = json.dumps(_instance(schema, schema.get("$defs", {})))
+    elif response_format.get("type") == "json_object":
+        message["content"] = "{}"
+
+    completion_tokens = _estimate_tokens(message)
+    prompt_tokens = _estimate_tokens(body.get("messages", []))
+    return {
+        "id": "chatcmpl-stub-" + request_key(body)[:16],
+        "object": "chat.completion",
+        "created": 0,
+        "model": body.get("model", "stub"),
+        "choices": [{"index": 0, "message": message, "logprobs": None,
+                     "finish_reason": "tool_calls" if tools else "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+
+def completion_chunks(completion: dict, include_usage: bool) -> list[dict]:
+    """The chat.completion.chunk objects a streaming request would have received for completion."""
+    choice = completion["choices"][0]
+    message = choice["message"]
+
+    def chunk(delta: dict, finish_reason=None, usage=None) -> dict:
+        choices = [] if usage else [{"index": 0, "delta": delta, "logprobs": None, "finish_reason": finish_reason}]
+        data = {"id": completion["id"], "object": "chat.completion.chunk", "created": completion.get("created", 0),
+                "model": completion["model"], "choices": choices}
+        if usage:
+            data["usage"] = usage
+        return data
+
+    chunks = [chunk({"role": "assistant", "content": ""})]
+    content = message.get("content") or ""
+    for start in range(0, len(content), STREAM_CHUNK_CHARACTERS):
+        chunks.append(chunk({"content": content[start:start + STREAM_CHUNK_CHARACTERS]}))
+    for index, tool_call in enumerate(message.get("tool_calls") or []):
+        chunks.append(chunk({"tool_calls": [{**tool_call, "index": index}]}))
+    chunks.append(chunk({}, choice.get("finish_reason") or "stop"))
+    if include_usage and completion.get("usage"):
+        chunks.append(chunk({}, usage=completion["usage"]))
+    return chunks
+
+
+def _sse(data: dict) -> bytes:
+    return f"data: {json.dumps(data)}\n\n".encode("utf-8")
+
+
+class LLMStub:
+    """
+    OpenAI-compatible /chat/completions. "record" forwards every request (non-streaming) to the client's real
+    base URL and stores the response, "replay" answers from the recordings, "synthetic" generates schema-valid
+    answers. A replay without a recording falls back to a synthetic answer. Latency is added on top.
+    """
+
+    def __init__(self, mode: str, cassette_path: Path = DEFAULT_CASSETTE, latency: Latency = None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown LLM stub mode '{mode}', expected one of {', '.join(MODES)}")
+        self.mode = mode
+        self.cassette = Cassette(cassette_path)
+        self.latency = latency or Latency()
+        self.stats = {"recorded": 0, "replayed": 0, "synthetic": 0, "misses": 0}
+
+    def _lookup(self, body: dict) -> tuple[Optional[dict], float]:
+        """Completion and recorded latency for replay and synthetic mode."""
+        if self.mode == "replay":
+            entry = self.cassette.get(request_key(body))
+            if entry is not None:
+                self.stats["replayed"] += 1
+                return entry["response"], entry["latency"]
+            self.stats["misses"] += 1
+            logging.warning(f"[LLMStub] No recording for a {body.get('model')} request, answering synthetically")
+        self.stats["synthetic"] += 1
+        return synthetic_completion(body), 0.0
+
+    @staticmethod
+    def _upstream_request(body: dict, headers) -> tuple[str, dict, dict]:
+        upstream = headers.get(UPSTREAM_HEADER)
+        if not upstream:
+            raise ValueError(f"Recording needs the {UPSTREAM_HEADER} header with the real base URL")
+        forwarded = {key: value for key, value in body.items() if key not in ("stream", "stream_options")}
+        auth = {"Authorization": headers["Authorization"]} if "Authorization" in headers else {}
+        return upstream.rstrip("/") + "/chat/completions", forwarded, auth
+
+    def _record(self, body: dict, completion: dict, latency: float):
+        self.cassette.add(request_key(body), body, completion, latency)
+        self.stats["recorded"] += 1
+
+    def complete(self, body: dict, headers) -> tuple[dict, float]:
+        """Completion for a request body and the latency to add before answering."""
+        if self.mode != "record":
+            completion, recorded = self._lookup(body)
+            return completion, self.latency.sample(recorded)
+
+        url, forwarded, auth = self._upstream_request(body, headers)
+        started = time.perf_counter()
+        with httpx.Client(timeout=120) as client:
+            response = client.post(url, json=forwarded, headers=auth)
+        response.raise_for_status()
+        completion = response.json()
+        self._record(body, completion, time.perf_counter() - started)
+        return completion, 0.0
+
+    async def acomplete(self, body: dict, headers) -> tuple[dict, float]:
+        if self.mode != "record":
+            completion, recorded = self._lookup(body)
+            return completion, self.latency.sample(recorded)
+
+        url, forwarded, auth = self._upstream_request(body, headers)
+        started = time.perf_counter()
+        async with httpx.AsyncClient(timeout=120) as client:
+            response = await client.post(url, json=forwarded, headers=auth)
+        response.raise_for_status()
+        completion = response.json()
+        self._record(body, completion, time.perf_counter() - started)
+        return completion, 0.0
+
+    @staticmethod
+    def _stream_plan(body: dict, completion: dict, latency: float) -> Iterator[tuple[float, bytes]]:
+        """(delay, bytes) pairs of a streamed answer; the first chunk carries most of the wait."""
+        chunks = completion_chunks(completion, (body.get("stream_options") or {}).get("include_usage", False))
+        first = latency * STREAM_FIRST_CHUNK_SHARE
+        rest = (latency - first) / max(1, len(chunks) - 1)
+        for i, chunk in enumerate(chunks):
+            yield (first if i == 0 else rest), _sse(chunk)
+        yield 0.0, b"data: [DONE]\n\n"
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        """httpx transport handler for synchronous clients."""
+        body = json.loads(request.content)
+        completion, latency = self.complete(body, request.headers)
+        if not body.get("stream"):
+            time.sleep(latency)
+            return httpx.Response(200, json=completion)
+
+        def stream():
+            for delay, data in self._stream_plan(body, completion, latency):
+                time.sleep(delay)
+                yield data
+        return httpx.Response(200, content=stream(), headers={"content-type": "text/event-stream"})
+
+    async def ahandle(self, request: httpx.Request) -> httpx.Response:
+        """httpx transport handler for asynchronous clients."""
+        body = json.loads(await request.aread())
+        completion, latency = await self.acomplete(body, request.headers)
+        if not body.get("stream"):
+            await asyncio.sleep(latency)
+            return httpx.Response(200, json=completion)
+
+        async def stream():
+            for delay, data in self._stream_plan(body, completion, latency):
+                await asyncio.sleep(delay)
+                yield data
+        return httpx.Response(200, content=stream(), headers={"content-type": "text/event-stream"})
+
+
+_stub: Optional[LLMStub] = None
+_stub_lock = threading.Lock()
+
+
+def get_stub() -> LLMStub:
+    """The in-process stub, configured from the PQ_LLM_STUB* settings."""
+    global _stub
+    with _stub_lock:
+        if _stub is None:
+            _stub = LLMStub(
+                settings.LLM_STUB_MODE,
+                Path(settings.LLM_STUB_CASSETTE) if settings.LLM_STUB_CASSETTE else DEFAULT_CASSETTE,
+                Latency(settings.LLM_STUB_LATENCY, settings.LLM_STUB_SEED),
+            )
+        return _stub
+
+
+def connection(base_url: str, api_key: Optional[str]) -> dict:
+    """
+    Connection arguments for a ChatOpenAI client. Unchanged unless PQ_LLM_STUB is set; then the client talks
+    to the stub (in this process, or at PQ_LLM_STUB_URL) and tells it its real base URL for recording.
+    """
+    if not settings.LLM_STUB_MODE:
+        return {"base_url": base_url, "api_key": api_key}
+
+    arguments = {
+        "base_url": settings.LLM_STUB_URL or IN_PROCESS_BASE_URL,
+        "api_key": api_key or "stub",
+        "default_headers": {UPSTREAM_HEADER: base_url},
+    }
+    if not settings.LLM_STUB_URL:
+        stub = get_stub()
+        arguments["http_client"] = httpx.Client(transport=httpx.MockTransport(stub.handle))
+        arguments["http_async_client"] = httpx.AsyncClient(transport=httpx.MockTransport(stub.ahandle))
+    return arguments
+
+
+def create_app(stub: LLMStub):
+    """The stub as a standalone OpenAI-compatible server (base URL http://host:port/v1)."""
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, StreamingResponse
+
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        completion, latency = await stub.acomplete(body, request.headers)
+        if not body.get("stream"):
+            await asyncio.sleep(latency)
+            return JSONResponse(completion)
+
+        async def stream():
+            for delay, data in stub._stream_plan(body, completion, latency):
+                await asyncio.sleep(delay)
+                yield data
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    def stats():
+        return {"mode": stub.mode, "recordings": len(stub.cassette), **stub.stats}
+
+    return app
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="OpenAI-compatible record/replay LLM stub")
+    parser.add_argument("--mode", choices=MODES, default=settings.LLM_STUB_MODE or "replay")
+    parser.add_argument("--cassette", type=Path, default=Path(settings.LLM_STUB_CASSETTE or DEFAULT_CASSETTE))
+    parser.add_argument("--latency", default=settings.LLM_STUB_LATENCY)
+    parser.add_argument("--seed", type=int, default=settings.LLM_STUB_SEED)
+    parser.add_argument("--port", type=int, default=8010)
+    args = parser.parse_args()
+
+    server_stub = LLMStub(args.mode, args.cassette, Latency(args.latency, args.seed))
+    uvicorn.run(create_app(server_stub), host="127.0.0.1", port=args.port)
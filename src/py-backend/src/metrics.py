@@ -0,0 +1,247 @@
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, UTC
+from pathlib import Path
+from typing import Optional
+
+import settings
+
+APPDATA_PATH = Path(os.getenv("APPDATA", Path.home()))
+TRACE_LOG_PATH = APPDATA_PATH / "personal-query" / "logs" / "traces.jsonl"
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple, le: Optional[str] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Prometheus-style histogram with cumulative buckets per label combination."""
+
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...] = (), buckets: tuple = DURATION_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series: dict[tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            series = self._series.setdefault(labels, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, str(bound))} {count}")
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, '+Inf')} {series[-1]}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {series[-2]}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {series[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+node_duration = Histogram("pq_node_duration_seconds", "Wall time of a graph node.", ("node",))
+node_errors = Counter("pq_node_errors_total", "Graph node runs that raised.", ("node",))
+request_duration = Histogram("pq_request_duration_seconds", "Wall time of a chat request.", ("kind",))
+llm_tokens = Histogram("pq_llm_tokens", "Tokens of one LLM call.", ("node", "kind"), TOKEN_BUCKETS)
+sql_rows = Histogram("pq_sql_rows", "Rows returned by a generated query.", (), ROW_BUCKETS)
+sql_bytes = Histogram("pq_sql_bytes", "Approximate formatted size of a query result.", (), BYTE_BUCKETS)
+checkpoint_bytes = Histogram("pq_checkpoint_write_bytes", "Serialized size of a checkpoint or pending write.",
+                             ("kind",), BYTE_BUCKETS)
+cache_requests = Counter("pq_cache_requests_total", "Cache lookups by cache and outcome.", ("cache", "result"))
+checkpoint_compactions = Counter("pq_checkpoint_compactions_total", "Runs of the checkpoint retention.")
+checkpoint_reclaimed = Counter("pq_checkpoint_reclaimed_bytes_total", "Bytes the checkpoint DB shrank by in compaction.")
+
+METRICS = [node_duration, node_errors, request_duration, llm_tokens, sql_rows, sql_bytes, checkpoint_bytes,
+           cache_requests, checkpoint_compactions, checkpoint_reclaimed]
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+
+class Trace:
+    def __init__(self, kind: str, chat_id: Optional[str]):
+        self.data = {
+            "trace_id": uuid.uuid4().hex,
+            "kind": kind,
+            "chat_id": chat_id,
+            "started_at": datetime.now(UTC).isoformat(),
+            "spans": [],
+            "checkpoint_bytes": 0,
+        }
+        self.started = time.perf_counter()
+
+    def offset_ms(self) -> float:
+        return round((time.perf_counter() - self.started) * 1000, 2)
+
+
+_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("pq_trace", default=None)
+_span: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("pq_span", default=None)
+_trace_lock = threading.Lock()
+
+
+def current_node() -> Optional[str]:
+    span = _span.get()
+    return span["node"] if span else None
+
+
+def _write_trace(trace: Trace):
+    line = json.dumps(trace.data, default=str)
+    try:
+        with _trace_lock:
+            TRACE_LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+            with TRACE_LOG_PATH.open("a", encoding="utf-8") as file:
+                file.write(line + "\n")
+    except OSError as e:
+        logging.warning(f"[metrics] Writing trace failed: {e}")
+
+
+def traced(kind: str):
+    """Time a chat request (run_chat, resume_stream) and, with PQ_TRACES, write its spans as one JSONL line."""
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            if not settings.METRICS_ENABLED:
+                return await fn(*args, **kwargs)
+            trace = Trace(kind, signature.bind_partial(*args, **kwargs).arguments.get("chat_id"))
+            token = _trace.set(trace)
+            try:
+                return await fn(*args, **kwargs)
+            except BaseException as e:
+                trace.data["error"] = repr(e)
+                raise
+            finally:
+                _trace.reset(token)
+                duration = time.perf_counter() - trace.started
+                request_duration.observe(duration, kind)
+                trace.data["duration_ms"] = round(duration * 1000, 2)
+                if settings.TRACES_ENABLED:
+                    _write_trace(trace)
+        return wrapper
+    return decorator
+
+
+def instrument(node):
+    """Record a graph node's wall time, and collect what it does (tokens, SQL) in a span of the current trace."""
+    if not settings.METRICS_ENABLED:
+        return node
+    name = node.__name__
+
+    @functools.wraps(node)
+    async def wrapper(state):
+        trace = _trace.get()
+        span = dict(node=name, start_ms=trace.offset_ms() if trace else 0.0)
+        token = _span.set(span)
+        started = time.perf_counter()
+        try:
+            return await node(state)
+        except BaseException as e:
+            node_errors.inc(name)
+            span["error"] = repr(e)
+            raise
+        finally:
+            _span.reset(token)
+            duration = time.perf_counter() - started
+            node_duration.observe(duration, name)
+            span["duration_ms"] = round(duration * 1000, 2)
+            if trace:
+                trace.data["spans"].append(span)
+    return wrapper
+
+
+def _add_to_span(**values):
+    span = _span.get()
+    if span is not None:
+        for key, value in values.items():
+            span[key] = span.get(key, 0) + value
+
+
+def observe_tokens(prompt_tokens: int, completion_tokens: int):
+    node = current_node() or "unknown"
+    llm_tokens.observe(prompt_tokens, node, "prompt")
+    llm_tokens.observe(completion_tokens, node, "completion")
+    _add_to_span(llm_calls=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+
+def observe_sql(rows: int, size: int):
+    sql_rows.observe(rows)
+    sql_bytes.observe(size)
+    _add_to_span(sql_rows=rows, sql_bytes=size)
+
+
+def observe_cache(cache: str, hit: bool):
+    cache_requests.inc(cache, "hit" if hit else "miss")
+    _add_to_span(**{f"{cache}_{'hits' if hit else 'misses'}": 1})
+
+
+def observe_checkpoint_compaction(reclaimed_bytes: int):
+    checkpoint_compactions.inc()
+    checkpoint_reclaimed.inc(amount=reclaimed_bytes)
+
+
+class MeasuredSerializer:
+    """Wraps the checkpointer's serializer to record the size of every checkpoint and pending write it stores."""
+
+    def __init__(self, serde):
+        self.serde = serde
+
+    def dumps_typed(self, obj):
+        type_, data = self.serde.dumps_typed(obj)
+        kind = "checkpoint" if isinstance(obj, dict) and "channel_values" in obj else "write"
+        checkpoint_bytes.observe(len(data), kind)
+        trace = _trace.get()
+        if trace:
+            trace.data["checkpoint_bytes"] += len(data)
+        return type_, data
+
+    def __getattr__(self, name):
+        return getattr(self.serde, name)
@@ -0,0 +1,208 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import warnings
+from pathlib import Path
+from typing import Iterable, Optional
+
+from langchain_core.load import dumpd, load
+from langchain_core.prompts import BasePromptTemplate
+
+import settings
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Shipped with the backend (datas of pq-backend.spec), written by export_bundle()
+PROMPT_BUNDLE_DIR = Path(getattr(sys, "_MEIPASS", BASE_DIR)) / "prompts" / "bundle"
+APPDATA_PATH = Path(os.getenv("APPDATA", Path.home()))
+# Copies pulled from the hub at runtime
+PROMPT_CACHE_DIR = APPDATA_PATH / "personal-query" / "prompts"
+
+MANIFEST = "manifest.json"
+
+# Every hub prompt the chains use, exported into the bundle
+HUB_PROMPTS = [
+    "activity_selection",
+    "classify_question",
+    "generate_title",
+    "give_context",
+    "get_relevant_tables",
+    "sql-query-system-prompt",
+    "user_input",
+    "window_activity",
+    "session",
+    "partial_answer",
+    "summarize_answers",
+    "generate_answer",
+    "general_answer",
+]
+
+
+def _file_name(name: str) -> str:
+    return name.replace("/", "__") + ".json"
+
+
+def _read(directory: Path, name: str) -> Optional[BasePromptTemplate]:
+    path = directory / _file_name(name)
+    if not path.exists():
+        return None
+    try:
+        with warnings.catch_warnings():
+            # load() is marked beta, and newer langchain-core asks for allowed_objects, which older ones reject
+            warnings.simplefilter("ignore")
+            return load(json.loads(path.read_text(encoding="utf-8"))["prompt"], secrets_from_env=False)
+    except Exception as e:
+        logging.warning(f"[PromptRegistry] Ignoring unreadable prompt file {path}: {e}")
+        return None
+
+
+def _write(directory: Path, name: str, prompt: BasePromptTemplate, version: Optional[str]):
+    directory.mkdir(parents=True, exist_ok=True)
+    data = {"name": name, "version": version, "prompt": dumpd(prompt)}
+    tmp = directory / (_file_name(name) + ".tmp")
+    tmp.write_text(json.dumps(data, indent=2), encoding="utf-8")
+    os.replace(tmp, directory / _file_name(name))
+
+
+def _pull(name: str) -> tuple[BasePromptTemplate, Optional[str]]:
+    # Imported here so that nothing touches the hub client unless a prompt actually has to be pulled
+    from langchain import hub
+    prompt = hub.pull(name)
+    version = (prompt.metadata or {}).get("lc_hub_commit_hash")
+    return prompt, version
+
+
+class PromptUnavailable(LookupError):
+    pass
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+class PromptRegistry:
+    """
+    Prompt templates by hub name, loaded on first use. Lookup order: prompts registered in code, the
+    bundle shipped with the backend, the local cache of hub pulls, and only then the hub itself.
+    With PQ_PROMPT_HUB_REFRESH the cache (refreshed in the background) takes precedence over the bundle.
+    The hub is never called from the event loop: preload() runs in a worker thread during initialize(), and a
+    prompt still missing later is pulled in the background while get() raises PromptUnavailable.
+    """
+    _prompts: dict[str, BasePromptTemplate] = {}
+    _local: dict[str, BasePromptTemplate] = {}
+    _lock = threading.Lock()
+    _pulling: set[str] = set()
+
+    @classmethod
+    def register(cls, name: str, prompt: BasePromptTemplate):
+        """Prompts defined in code rather than on the hub."""
+        cls._local[name] = prompt
+
+    @classmethod
+    def get(cls, name: str) -> BasePromptTemplate:
+        prompt = cls._prompts.get(name) or cls._local.get(name)
+        if prompt is not None:
+            return prompt
+
+        prompt = cls._read_local(name)
+        if prompt is None:
+            if _on_event_loop():
+                cls._pull_in_background(name)
+                raise PromptUnavailable(
+                    f"Prompt '{name}' is not in the bundle or the local cache, it is being pulled from the hub"
+                )
+            prompt = cls._pull(name)
+
+        # The lock only guards the dict, never file or network I/O
+        with cls._lock:
+            return cls._prompts.setdefault(name, prompt)
+
+    @classmethod
+    def _read_local(cls, name: str) -> Optional[BasePromptTemplate]:
+        directories = [PROMPT_BUNDLE_DIR, PROMPT_CACHE_DIR]
+        if settings.PROMPT_HUB_REFRESH:
+            directories.reverse()
+        for directory in directories:
+            prompt = _read(directory, name)
+            if prompt is not None:
+                return prompt
+        return None
+
+    @classmethod
+    def _pull(cls, name: str) -> BasePromptTemplate:
+        logging.info(f"[PromptRegistry] '{name}' is not available locally, pulling it from the hub")
+        prompt, version = _pull(name)
+        _write(PROMPT_CACHE_DIR, name, prompt, version)
+        return prompt
+
+    @classmethod
+    def _pull_in_background(cls, name: str):
+        with cls._lock:
+            if name in cls._pulling:
+                return
+            cls._pulling.add(name)
+
+        def pull():
+            try:
+                prompt = cls._pull(name)
+                with cls._lock:
+                    cls._prompts.setdefault(name, prompt)
+            except Exception as e:
+                logging.warning(f"[PromptRegistry] Pulling '{name}' failed: {e}")
+            finally:
+                with cls._lock:
+                    cls._pulling.discard(name)
+
+        threading.Thread(target=pull, name=f"prompt-pull-{name}", daemon=True).start()
+
+    @classmethod
+    def preload(cls, names: Iterable[str] = HUB_PROMPTS) -> list[str]:
+        """Resolve every prompt up front, off the event loop. Returns the names that could not be loaded."""
+        if not (PROMPT_BUNDLE_DIR / MANIFEST).exists():
+            logging.warning(f"[PromptRegistry] No prompt bundle at {PROMPT_BUNDLE_DIR}, prompts come from the cache "
+                            f"or the hub; export one with 'python prompt_registry.py'")
+        missing = []
+        for name in names:
+            try:
+                cls.get(name)
+            except Exception as e:
+                logging.error(f"[PromptRegistry] '{name}' is missing from the bundle and the hub pull failed: {e}")
+                missing.append(name)
+        return missing
+
+    @classmethod
+    def refresh(cls, names: Iterable[str] = HUB_PROMPTS):
+        """Pull the latest versions from the hub into the cache and swap them in. Failures keep the old ones."""
+        for name in names:
+            try:
+                prompt, version = _pull(name)
+            except Exception as e:
+                logging.warning(f"[PromptRegistry] Refreshing '{name}' failed: {e}")
+                continue
+            _write(PROMPT_CACHE_DIR, name, prompt, version)
+            with cls._lock:
+                cls._prompts[name] = prompt
+
+
+def export_bundle(directory: Path = PROMPT_BUNDLE_DIR, names: Iterable[str] = HUB_PROMPTS):
+    """Pull every hub prompt and write it, with a manifest of versions, into the bundle directory."""
+    manifest = {}
+    for name in names:
+        prompt, version = _pull(name)
+        _write(directory, name, prompt, version)
+        manifest[name] = version
+        print(f"Exported {name} ({version or 'unversioned'})")
+    (directory / MANIFEST).write_text(json.dumps(manifest, indent=2, sort_keys=True), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    from helper.env_loader import load_env
+
+    load_env()
+    export_bundle()
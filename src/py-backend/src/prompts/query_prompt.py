@@ -1,15 +1,13 @@
-from langchain import hub
 from dotenv import load_dotenv
 
 from database import get_db
 from helper.env_loader import load_env
+from prompt_registry import PromptRegistry
 from schemas import State
 from langchain_community.utilities import SQLDatabase
 
 load_env()
 
-query_prompt_template = hub.pull("langchain-ai/sql-query-system-prompt")
-
 db = get_db()
 
 
@@ -17,7 +15,7 @@ def create_query_prompt(state: State):
     """Generate SQL query to fetch information."""
     tables_to_use = state["tables"] if state.get("tables") else db.get_usable_table_names()
 
-    prompt = query_prompt_template.invoke(
+    prompt = PromptRegistry.get("langchain-ai/sql-query-system-prompt").invoke(
         {
             "dialect": db.dialect,
             "top_k": 50,
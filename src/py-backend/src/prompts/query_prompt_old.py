@@ -1,15 +1,13 @@
-from langchain import hub
 from typing_extensions import Annotated, TypedDict
 from dotenv import load_dotenv
 
 from helper.env_loader import load_env
+from prompt_registry import PromptRegistry
 from schemas import State
 from langchain_community.utilities import SQLDatabase
 
 load_env()
 
-query_prompt_template = hub.pull("langchain-ai/sql-query-system-prompt")
-
 
 class QueryOutput(TypedDict):
     """Generated SQL query"""
@@ -19,7 +17,7 @@ class QueryOutput(TypedDict):
 def create_query_prompt_old(state: State, db: SQLDatabase):
     """Generate SQL query to fetch information."""
 
-    prompt = query_prompt_template.invoke(
+    prompt = PromptRegistry.get("langchain-ai/sql-query-system-prompt").invoke(
         {
             "dialect": db.dialect,
             "top_k": 10,
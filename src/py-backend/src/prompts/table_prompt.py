@@ -1,16 +1,14 @@
-from langchain import hub
 from dotenv import load_dotenv
 
 from helper.env_loader import load_env
+from prompt_registry import PromptRegistry
 from schemas import State
 
 load_env()
 
-prompt_template = hub.pull("get_relevant_tables")
-
 
 def create_get_table_prompt(state: State):
-    prompt = prompt_template.invoke(
+    prompt = PromptRegistry.get("get_relevant_tables").invoke(
         {
             "question": state["question"],
         }
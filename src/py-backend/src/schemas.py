@@ -16,10 +16,17 @@ class State(TypedDict):
     tables: List[str]
     activities: List[str]
     query: str
+    # helper.query_plan preflight of query: strategy, estimated rows, full scans, plan summary
+    preflight: dict
+    preflight_retries: int
+    # Hint for write_query after a too broad query
+    query_feedback: str
     raw_result: str
     result: List[str]
+    truncated: bool
     answer: str
     top_k: int
+    planned: bool
 
 
 class QueryOutput(TypedDict):
@@ -44,3 +51,11 @@ class QuestionType(TypedDict):
 class Question(TypedDict):
     """Type of question asked from the user."""
     question: Annotated[str, ..., "Enriched question by adding time context."]
+
+
+class Plan(BaseModel):
+    """Plan for answering the user's latest message."""
+    questionType: str = Field(description='"data_query" if answering needs the user\'s tracked data, otherwise "general".')
+    question: str = Field(description="Standalone question with relative time expressions resolved to absolute dates.")
+    tables: List[str] = Field(description="Names of the tables needed to answer the question.")
+    activities: List[str] = Field(description="Activity labels to filter window_activity on.")
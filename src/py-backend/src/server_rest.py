@@ -1,21 +1,66 @@
+import asyncio
+import importlib
 import logging
-from contextlib import asynccontextmanager
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager, suppress
+from typing import Callable, Optional
+from uuid import uuid4
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
-from chat_engine import run_chat, get_chat_history, initialize, delete_chat, rename_chat, resume_stream
+from fastapi.responses import PlainTextResponse
+
+import metrics
+import settings
 from database import DB_PATH
-from helper.chat_utils import get_next_thread_id, list_chats
-from helper.db_modification import update_sessions_from_usage_data, add_window_activity_durations
+from checkpoint_db import get_checkpoint_db
+from helper.ws_utils import set_update_listener, pop_update_listener, remove_update_listeners
+from helper.data_refresh import refresh_derived_data
+
+
+STARTED_AT = time.perf_counter()
+
+# chat_engine (LangGraph, langchain_openai) takes seconds to import, so it is loaded by start_engine()
+engine_task: Optional[asyncio.Task] = None
+engine_status = {"status": "starting", "error": None, "ready_after_seconds": None}
+
+
+async def start_engine():
+    """Import chat_engine without blocking the event loop and initialize it."""
+    try:
+        engine = await asyncio.to_thread(importlib.import_module, "chat_engine")
+        await engine.initialize()
+    except Exception as e:
+        logging.error(f"[start_engine] Initialization failed: {e}")
+        engine_status.update(status="error", error=str(e))
+        raise
+    engine_status.update(status="ready", ready_after_seconds=round(time.perf_counter() - STARTED_AT, 3))
+    return engine
+
+
+async def get_engine():
+    """The initialized chat_engine module, waiting for the background initialization if necessary."""
+    return await asyncio.shield(engine_task)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global engine_task
+    engine_task = asyncio.create_task(start_engine())
+    if not settings.FAST_STARTUP:
+        await engine_task
     yield
+    if engine_task.done():
+        if not engine_task.cancelled() and engine_task.exception() is None:
+            await engine_task.result().shutdown()
+    else:
+        engine_task.cancel()
+        with suppress(BaseException):
+            await engine_task
     logging.info("✅ Backend shutting down")
 
 
-initialize()
 app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
@@ -26,58 +71,131 @@ app.add_middleware(
 )
 
 
+@app.get("/health")
+def health():
+    """Answers as soon as the server is bound; status turns from "starting" to "ready" (or "error")."""
+    return {**engine_status, "uptime_seconds": round(time.perf_counter() - STARTED_AT, 3)}
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Node latency, token, SQL, checkpoint and cache metrics in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.websocket("/ws")
 async def websocket_chat(websocket: WebSocket):
+    """
+    Every question runs as its own task so several chats can be in flight on one socket. Frames carry the
+    request_id of the question they belong to; {"type": "cancel", "request_id": ...} stops that run.
+    """
     await websocket.accept()
 
+    send_lock = asyncio.Lock()
+    slots = asyncio.Semaphore(settings.WS_MAX_CONCURRENT_REQUESTS)
+    chat_locks: dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+    tasks: dict[str, asyncio.Task] = {}
+    # The latest on_update per chat handed to set_update_listener, removed again on disconnect
+    awaiting_approval: dict[str, Callable] = {}
+
+    async def send(message: dict):
+        async with send_lock:
+            await websocket.send_json(message)
+
+    async def handle_request(request_id: str, data: dict):
+        question = data.get("question", "")
+        chat_id = data.get("chat_id", "1")
+        top_k = data.get("top_k", 150)
+        auto_approve = data.get("auto_approve", False)
+        stream_tokens = data.get("stream_tokens", settings.STREAM_TOKENS)
+
+        async def on_update(update: dict):
+            await send({**update, "request_id": request_id})
+
+        try:
+            # Runs on the same chat share one checkpoint thread, so they go one after another. The chat lock
+            # comes first: questions queued behind a busy chat must not hold a slot other chats could use.
+            async with chat_locks[chat_id], slots:
+                engine = await get_engine()
+                msg = await engine.run_chat(question, chat_id, top_k, auto_approve, on_update=on_update,
+                                     stream_tokens=stream_tokens)
+            if msg:
+                await on_update(msg)
+            else:
+                set_update_listener(chat_id, on_update)
+                awaiting_approval[chat_id] = on_update
+        except asyncio.CancelledError:
+            with suppress(Exception):
+                await on_update({"type": "cancelled", "chat_id": chat_id})
+            raise
+        except Exception as e:
+            logging.error(f"[websocket_chat] Request {request_id} failed: {e}")
+            with suppress(Exception):
+                await on_update({"type": "error", "chat_id": chat_id, "message": str(e)})
+        finally:
+            if tasks.get(request_id) is asyncio.current_task():
+                del tasks[request_id]
+
     try:
         while True:
             data = await websocket.receive_json()
 
-            question = data.get("question", "")
-            chat_id = data.get("chat_id", "1")
-            top_k = data.get("top_k", 150)
-            auto_approve = data.get("auto_approve", False)
+            if data.get("type") == "cancel":
+                task = tasks.get(data.get("request_id"))
+                if task:
+                    task.cancel()
+                continue
 
-            async def on_update(update: dict):
-                await websocket.send_json(update)
-
-            msg = await run_chat(question, chat_id, top_k, auto_approve, on_update=on_update)
-            if msg:
-                await websocket.send_json(msg)
+            request_id = str(data.get("request_id") or uuid4())
+            if request_id in tasks:
+                # Would make the running request impossible to cancel
+                await send({"type": "error", "chat_id": data.get("chat_id", "1"), "request_id": request_id,
+                            "message": f"Request {request_id} is still running."})
+                continue
+            tasks[request_id] = asyncio.create_task(handle_request(request_id, data))
 
     except WebSocketDisconnect:
+        for task in list(tasks.values()):
+            task.cancel()
+        remove_update_listeners(set(awaiting_approval.values()))
         logging.info("Client disconnected")
 
 
 @app.post("/chats")
 def create_chat():
     """Create a new chat and return its thread ID."""
-    chat_id = get_next_thread_id()
+    chat_id = get_checkpoint_db().get_next_thread_id()
     return {"chat_id": chat_id}
 
 
 @app.get("/chats")
-def get_all_chats():
-    """Return a list of all chat thread IDs."""
-    return {"chats": list_chats()}
+def get_all_chats(limit: Optional[int] = None, cursor: Optional[str] = None, order: str = "desc"):
+    """Return chats ordered by last activity, optionally one page at a time via limit and next_cursor."""
+    try:
+        chats, next_cursor = get_checkpoint_db().list_chats(limit, cursor, order)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    return {"chats": chats, "next_cursor": next_cursor}
 
 
 @app.get("/chats/{chat_id}")
-def get_chat(chat_id: str):
+async def get_chat(chat_id: str):
     """Return message history for a given chat."""
-    return get_chat_history(chat_id)
+    engine = await get_engine()
+    return await engine.get_chat_history(chat_id)
 
 
 @app.delete("/chats/{chat_id}")
-def remove_chat(chat_id: str):
-    return delete_chat(chat_id)
+async def remove_chat(chat_id: str):
+    engine = await get_engine()
+    return await asyncio.to_thread(engine.delete_chat, chat_id)
 
 
 @app.put("/chats/{chat_id}/rename")
-def rename_chat_endpoint(chat_id: str, new_title: str = Body(..., embed=True)):
+async def rename_chat_endpoint(chat_id: str, new_title: str = Body(..., embed=True)):
     """Rename an existing chat by its chat_id."""
-    return rename_chat(chat_id, new_title)
+    engine = await get_engine()
+    return await asyncio.to_thread(engine.rename_chat, chat_id, new_title)
 
 
 @app.post("/approval")
@@ -89,17 +207,26 @@ async def handle_approval(request: Request):
     if not isinstance(approval, bool):
         return {"status": "error", "message": "Missing or invalid 'approval' boolean."}
 
+    on_update = pop_update_listener(chat_id)
     if approval:
-        msg = resume_stream(chat_id)
+        engine = await get_engine()
+        msg = await engine.resume_stream(chat_id, on_update=on_update)
         return msg
     else:
+        await asyncio.to_thread(get_checkpoint_db().set_pending_approval, chat_id, False)
         return {}
 
+
+@app.post("/checkpoints/compact")
+async def compact_checkpoints():
+    """Run the checkpoint retention now and report what was deleted and how many bytes were reclaimed."""
+    engine = await get_engine()
+    return await engine.compact_checkpoints()
+
 @app.post("/initialize-data")
 def initialize_data():
     try:
-        update_sessions_from_usage_data(DB_PATH)
-        add_window_activity_durations(DB_PATH)
+        refresh_derived_data(DB_PATH)
         return {"status": "success"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
@@ -0,0 +1,121 @@
+import os
+
+from helper.env_loader import load_env
+
+load_env()
+
+
+def _get_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _get_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+# Map-reduce summarization of large query results (answer_chain.generate_answer)
+CHUNK_SUMMARY_CONCURRENCY = _get_int("PQ_CHUNK_SUMMARY_CONCURRENCY", 4)
+CHUNK_SUMMARY_RETRIES = _get_int("PQ_CHUNK_SUMMARY_RETRIES", 2)
+SUMMARY_TREE_REDUCE = _get_bool("PQ_SUMMARY_TREE_REDUCE", True)
+SUMMARY_FAN_IN = _get_int("PQ_SUMMARY_FAN_IN", 8)
+
+# Token budget per result chunk sent to the model, by model name (helper.result_utils chunking)
+CHUNK_TOKEN_BUDGETS = {
+    "gpt-4o": 48000,
+    "llama31instruct": 4000,
+}
+DEFAULT_CHUNK_TOKEN_BUDGET = _get_int("PQ_CHUNK_TOKEN_BUDGET", 8000)
+
+
+def chunk_token_budget(model_name: str) -> int:
+    if os.getenv("PQ_CHUNK_TOKEN_BUDGET"):
+        return DEFAULT_CHUNK_TOKEN_BUDGET
+    return CHUNK_TOKEN_BUDGETS.get(model_name, DEFAULT_CHUNK_TOKEN_BUDGET)
+
+# Layout of the result chunks sent to the model, by model name: "markdown", "tsv", "csv" or "compact"
+# (helper.result_utils.FORMATS). Markdown unless a model is listed here (e.g. "gpt-4o": "tsv") or
+# PQ_RESULT_FORMAT is set. The result shown in the UI is always markdown.
+RESULT_FORMATS: dict[str, str] = {}
+DEFAULT_RESULT_FORMAT = os.getenv("PQ_RESULT_FORMAT", "markdown")
+
+
+def result_format(model_name: str) -> str:
+    if os.getenv("PQ_RESULT_FORMAT"):
+        return DEFAULT_RESULT_FORMAT
+    return RESULT_FORMATS.get(model_name, DEFAULT_RESULT_FORMAT)
+
+# Table descriptions for write_query when no tables were selected (helper.schema_info)
+SCHEMA_SAMPLE_ROWS = _get_int("PQ_SCHEMA_SAMPLE_ROWS", 3)
+SCHEMA_COLUMN_PRUNING = _get_bool("PQ_SCHEMA_COLUMN_PRUNING", True)
+
+# Limits on queries against the tracker DB (sql_executor); longer results are truncated and flagged as such
+SQL_TIMEOUT_SECONDS = _get_int("PQ_SQL_TIMEOUT_SECONDS", 30)
+SQL_MAX_ROWS = _get_int("PQ_SQL_MAX_ROWS", 50000)
+SQL_MAX_BYTES = _get_int("PQ_SQL_MAX_BYTES", 32 * 1024 * 1024)
+SQL_FETCH_SIZE = _get_int("PQ_SQL_FETCH_SIZE", 500)
+
+# Preflight of generated queries (helper.query_plan): EXPLAIN QUERY PLAN and a COUNT(*) bounded by this timeout,
+# then fetched as is (up to PREFLIGHT_FETCH_MAX_ROWS rows), aggregated locally, or sent back to write_query as too broad
+PREFLIGHT_ENABLED = _get_bool("PQ_PREFLIGHT", True)
+PREFLIGHT_TIMEOUT_SECONDS = _get_int("PQ_PREFLIGHT_TIMEOUT_SECONDS", 2)
+PREFLIGHT_FETCH_MAX_ROWS = _get_int("PQ_PREFLIGHT_FETCH_MAX_ROWS", 5000)
+# Full scans of tables with at least this many rows are called out in the plan summary
+PREFLIGHT_LARGE_TABLE_ROWS = _get_int("PQ_PREFLIGHT_LARGE_TABLE_ROWS", 100000)
+# Times a too broad query goes back to write_query before its result is aggregated instead
+PREFLIGHT_MAX_RETRIES = _get_int("PQ_PREFLIGHT_MAX_RETRIES", 1)
+PREFLIGHT_AGGREGATE_MAX_GROUPS = _get_int("PQ_PREFLIGHT_AGGREGATE_MAX_GROUPS", 200)
+
+# Before generated queries run, the replica and rollups (helper.data_refresh) are synced with the tracker DB
+# if it changed; compared at most every this many seconds
+DATA_REFRESH_INTERVAL_SECONDS = _get_int("PQ_DATA_REFRESH_INTERVAL_SECONDS", 30)
+
+# SQL result cache (helper.query_cache), size in characters of cached markdown; 0 disables it
+QUERY_CACHE_MAX_SIZE = _get_int("PQ_QUERY_CACHE_MAX_SIZE", 64 * 1024 * 1024)
+
+# Persistent memoization of deterministic LLM steps (helper.llm_cache), opt-in
+LLM_CACHE_ENABLED = _get_bool("PQ_LLM_CACHE", False)
+LLM_CACHE_TTL_SECONDS = _get_int("PQ_LLM_CACHE_TTL_SECONDS", 7 * 24 * 3600)
+LLM_CACHE_MAX_ENTRIES = _get_int("PQ_LLM_CACHE_MAX_ENTRIES", 5000)
+# Time-sensitive steps ("today", "last week") are keyed on current_time rounded down to this many seconds
+LLM_CACHE_TIME_GRANULARITY_SECONDS = _get_int("PQ_LLM_CACHE_TIME_GRANULARITY_SECONDS", 3600)
+
+# Prefer prompts refreshed from the hub (prompt_registry) over the bundled ones, and refresh them at startup
+PROMPT_HUB_REFRESH = _get_bool("PQ_PROMPT_HUB_REFRESH", False)
+
+# Graph topology built by chat_engine.initialize(): "fine_grained" or "planner"
+GRAPH_TOPOLOGY = os.getenv("PQ_GRAPH_TOPOLOGY", "fine_grained")
+# Planner mode only sends this many of the latest non-system messages
+PLANNER_HISTORY_MESSAGES = _get_int("PQ_PLANNER_HISTORY_MESSAGES", 6)
+
+# Forward answer tokens over the websocket as {"type": "token"} frames (clients can override per message)
+STREAM_TOKENS = _get_bool("PQ_STREAM_TOKENS", True)
+
+# In-flight websocket requests per connection; further questions wait for a free slot
+WS_MAX_CONCURRENT_REQUESTS = _get_int("PQ_WS_MAX_CONCURRENT_REQUESTS", 3)
+
+# Bind the server and answer /health right away while chat_engine is imported and initialized in the background
+FAST_STARTUP = _get_bool("PQ_FAST_STARTUP", True)
+
+# OpenAI-compatible stub (llm_stub) that all LLM clients are pointed at: "record", "replay" or "synthetic"; unset is off
+LLM_STUB_MODE = os.getenv("PQ_LLM_STUB", "")
+# Base URL of a stub started with `python llm_stub.py` (e.g. http://127.0.0.1:8010/v1); unset runs it in-process
+LLM_STUB_URL = os.getenv("PQ_LLM_STUB_URL", "")
+# Recordings file, default personal-query/llm_stub/cassette.jsonl
+LLM_STUB_CASSETTE = os.getenv("PQ_LLM_STUB_CASSETTE", "")
+# Added latency: "none", "recorded", "fixed:S", "uniform:A,B", "normal:MEAN,SD" or "lognormal:MEDIAN,SIGMA"
+LLM_STUB_LATENCY = os.getenv("PQ_LLM_STUB_LATENCY", "none")
+LLM_STUB_SEED = _get_int("PQ_LLM_STUB_SEED", 0)
+
+# Checkpoint retention (chat_engine.run_checkpoint_retention): every this many seconds, starting one interval after
+# startup, all but the latest checkpoint of each thread not pending approval are dropped and the file is vacuumed;
+# 0 turns it off
+CHECKPOINT_RETENTION_INTERVAL_SECONDS = _get_int("PQ_CHECKPOINT_RETENTION_INTERVAL_SECONDS", 3600)
+
+# Per-node latency, token, SQL and checkpoint metrics (metrics), served at /metrics
+METRICS_ENABLED = _get_bool("PQ_METRICS", True)
+# Also write every chat request's node spans to personal-query/logs/traces.jsonl
+TRACES_ENABLED = _get_bool("PQ_TRACES", False)
@@ -0,0 +1,110 @@
+import asyncio
+import sqlite3
+import time
+from typing import NamedTuple, Optional
+
+import settings
+from database import connect_readonly
+from helper.result_utils import ColumnarResult
+
+# SQLite virtual machine instructions between two deadline checks
+PROGRESS_INTERVAL = 1000
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+class QueryResult(NamedTuple):
+    result: ColumnarResult
+    # Rows were cut off by the row/byte budget or the timeout
+    truncated: bool
+    timed_out: bool
+    # Approximate formatted size in characters (row_size)
+    size: int
+
+
+def row_size(row: tuple) -> int:
+    """Approximate size of a row once formatted, in characters."""
+    return sum(len(str(value)) for value in row) + 3 * len(row)
+
+
+class QueryExecution:
+    """
+    One statement on the read-only tracker DB, on a connection of its own. run() connects and blocks and is
+    meant for a worker thread; cancel() may be called from any other thread and makes run() return promptly.
+    """
+
+    def __init__(self, sql: str, timeout: float, max_rows: int, max_bytes: int):
+        self.sql = sql
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.conn: Optional[sqlite3.Connection] = None
+        self.cancelled = False
+        self._deadline = None
+
+    def _past_deadline(self) -> bool:
+        return time.monotonic() > self._deadline
+
+    def _should_abort(self) -> int:
+        return int(self.cancelled or self._past_deadline())
+
+    def run(self) -> QueryResult:
+        self._deadline = time.monotonic() + self.timeout
+        self.conn = connect_readonly()
+        # Also catches a cancel() that came before the statement started, which interrupt() alone would miss
+        self.conn.set_progress_handler(self._should_abort, PROGRESS_INTERVAL)
+
+        result, size, truncated, timed_out = ColumnarResult([]), 0, False, False
+        try:
+            cursor = self.conn.execute(self.sql)
+            result = ColumnarResult([column[0] for column in cursor.description or []])
+            while not truncated:
+                batch = cursor.fetchmany(settings.SQL_FETCH_SIZE)
+                if not batch:
+                    break
+                keep = min(len(batch), self.max_rows - len(result))
+                for i, row in enumerate(batch[:keep]):
+                    size += row_size(row)
+                    if size > self.max_bytes:
+                        keep = i
+                        break
+                truncated = keep < len(batch)
+                result.extend(batch[:keep])
+        except sqlite3.OperationalError as e:
+            if self.cancelled or not self._past_deadline():
+                raise
+            # Timed out while fetching: what we have so far is still worth answering from
+            if not len(result):
+                raise QueryTimeout(f"Query did not finish within {self.timeout:g} seconds") from e
+            truncated = timed_out = True
+        finally:
+            self.conn.close()
+
+        return QueryResult(result, truncated, timed_out, size)
+
+    def cancel(self):
+        self.cancelled = True
+        if self.conn is None:
+            return  # run() hasn't connected yet, its progress handler sees the flag
+        try:
+            self.conn.interrupt()
+        except sqlite3.ProgrammingError:
+            pass  # already finished and closed
+
+
+async def execute(sql: str, timeout: float = None, max_rows: int = None,
+                  max_bytes: int = None) -> QueryResult:
+    """Run sql off the event loop; cancelling the awaiting task interrupts the statement."""
+    execution = QueryExecution(
+        sql,
+        timeout if timeout is not None else settings.SQL_TIMEOUT_SECONDS,
+        max_rows if max_rows is not None else settings.SQL_MAX_ROWS,
+        max_bytes if max_bytes is not None else settings.SQL_MAX_BYTES,
+    )
+    try:
+        return await asyncio.to_thread(execution.run)
+    except asyncio.CancelledError:
+        execution.cancel()
+        raise